@@ -3,6 +3,13 @@ The simulation of Turing Machine. It is not an actual Turing Machine
 and it is much slower and need to take extra steps to simulate. This
 is for studying purpose only.
 """
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+from array import array
+from collections import deque
 
 "Pointer movement, N=not moving, L=left, R=right"
 N = 0
@@ -13,6 +20,13 @@ R = 2
 ACCEPT = 0
 REJECT = 1
 
+"Names of the pointer movements in machine files"
+MOVES = {'N': N, 'L': L, 'R': R}
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ideas-tm")
+# Part of the cache key, change it when the compiled machines change
+_CACHE_VERSION = 2
+
 
 class State:
     """
@@ -91,8 +105,84 @@ class TM:
         self.t = t
         self.q0 = q0
         self.qa = qa
+        self._compiled = None
+
+    @classmethod
+    def from_dict(cls, machine):
+        """
+        Build a machine from its description, raise ValueError if it is not
+        valid. The description is a dict like:
+
+            {
+                "states": ["q0", "q1"],
+                "start": "q0",
+                "accept": "q1",
+                "transitions": [["q0", "1", "q0", null, "R"], ["q0", "_", "q1", "1", "N"]]
+            }
+
+        where every transition is `[from state, char read, to state,
+        replacement or null, movement]` and the movement is N, L or R.
+        """
+        if not isinstance(machine, dict):
+            raise ValueError("The machine must be an object")
+        for key in ("states", "start", "accept", "transitions"):
+            if key not in machine:
+                raise ValueError(f"Missing {key}")
+        names = machine["states"]
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            raise ValueError("states must be a list of names")
+        if len(set(names)) != len(names):
+            raise ValueError("Duplicate state names")
+        states = {n: State(n) for n in names}
+        for key in ("start", "accept"):
+            if not isinstance(machine[key], str) or machine[key] not in states:
+                raise ValueError(f"Unknown {key} state {machine[key]}")
+        if not isinstance(machine["transitions"], list):
+            raise ValueError("transitions must be a list")
+        t = []
+        seen = set()
+        for i, transit in enumerate(machine["transitions"]):
+            if not isinstance(transit, list) or len(transit) != 5:
+                raise ValueError(f"Transition {i} must be [from, read, to, write, move]")
+            fs, ch, ts, repl, mv = transit
+            if not isinstance(fs, str) or not isinstance(ts, str) or fs not in states or ts not in states:
+                raise ValueError(f"Transition {i} uses an unknown state")
+            if not isinstance(ch, str) or len(ch) != 1 or (repl is not None and (not isinstance(repl, str) or len(repl) != 1)):
+                raise ValueError(f"Transition {i} must read and write single chars")
+            if not isinstance(mv, str) or mv not in MOVES:
+                raise ValueError(f"Transition {i} has an invalid movement {mv}")
+            if (fs, ch) in seen:
+                raise ValueError(f"Transition {i} is a second transition from {fs} reading {ch}")
+            seen.add((fs, ch))
+            t.append(Transit(ch, states[fs], states[ts], repl, MOVES[mv]))
+        return cls(list(states.values()), t, states[machine["start"]], states[machine["accept"]])
+
+    def to_dict(self):
+        """
+        Return the description of the machine, see `from_dict`.
+        """
+        states = []
+        for state in [self.q0] + [s for f in self.t for s in (f.fs, f.ts)] + [self.qa]:
+            if state not in states:
+                states.append(state)
+        moves = {v: k for k, v in MOVES.items()}
+        return {
+            "states": [str(s) for s in states],
+            "start": str(self.q0),
+            "accept": str(self.qa),
+            "transitions": [[str(f.fs), f.ch, str(f.ts), f.repl or None, moves[f.mv]] for f in self.t],
+        }
+
+    def compile(self):
+        """
+        Compile the machine into integer transition tables (see `CompiledTM`),
+        the result is cached.
+        """
+        if self._compiled is None:
+            self._compiled = CompiledTM(self.t, self.q0, self.qa)
+        return self._compiled
     
-    def run(self, inp, trace=False, maxout=-1, startspace=False, endspace=True):
+    def run(self, inp, trace=False, maxout=-1, startspace=False, endspace=True, fast=False, accelerate=False):
         """
         Run the Turing Machine and feed the given input. Return `REJECT` if the
         steps limit is given and the machine did not halt within given number of
@@ -101,7 +191,9 @@ class TM:
 
         `inp`: The input string
 
-        `trace`: Tracing the run of the TM
+        `trace`: Tracing the run of the TM, True prints every step. A `Tracer`
+        records the steps of the compiled machine instead, which is much
+        faster (see `Tracer`).
 
         `maxout`: Max steps that will be executed, if over the limit REJECT immediately.
         If it is not given, it might cause an infinite loop.
@@ -109,7 +201,21 @@ class TM:
         `startspace`: Add blank character `_` to the start of the input
 
         `endspace`: Add blank character `_` to the end of the input
+
+        `fast`: Run the compiled machine (see `compile`), every step takes
+        constant time instead of rebuilding the tape. The tape is unbounded
+        in both directions instead of stopping at the first character.
+        Ignored if `trace` is set.
+
+        `accelerate`: Run the compiled machine with macro steps over sweeps
+        and cycle detection, see `CompiledTM.run`. Ignored if `trace` is set.
         """
+        if isinstance(trace, Tracer) or ((fast or accelerate) and not trace):
+            tracer = trace if isinstance(trace, Tracer) else None
+            result, tape, _ = self._run_compiled(inp, maxout, startspace, endspace, accelerate, tracer)
+            if result == ACCEPT:
+                self.last = tape
+            return result
         step = 0
         s = self.q0
         ptr = 0
@@ -171,6 +277,37 @@ class TM:
                 ptr = len(inp) - 1
             step += 1
     
+    def run_many(self, inputs, maxout=-1, startspace=False, endspace=True, accelerate=False, workers=None,
+                 ordered=True, chunksize=16):
+        """
+        Run the compiled machine on many inputs in a pool of worker processes,
+        yield `(input, ACCEPT or REJECT, final tape, steps)` for every input.
+        Unlike `run`, `last` is not changed.
+
+        `maxout`: Max steps for every input, see `run`
+
+        `accelerate`: Use macro steps and cycle detection, see `run`
+
+        `workers`: Number of processes, default is the number of CPUs. With 1
+        worker everything runs in the current process.
+
+        `ordered`: Yield the results in the order of the inputs, otherwise as
+        soon as they are done
+
+        `chunksize`: Number of inputs sent to a worker at once
+        """
+        # Compile once here, the workers get a copy of the compiled tables
+        self.compile()
+        workers = workers or os.cpu_count()
+        options = (maxout, startspace, endspace, accelerate)
+        if workers == 1:
+            _init_worker(self, options)
+            yield from map(_run_worker, inputs)
+            return
+        with multiprocessing.Pool(workers, _init_worker, (self, options)) as pool:
+            run = pool.imap if ordered else pool.imap_unordered
+            yield from run(_run_worker, inputs, chunksize)
+
     def observe(self):
         """
         Observe the accepted result of the last run, remove spaces and only return
@@ -178,6 +315,10 @@ class TM:
         """
         return self.last.replace('_', '') if self.last else None
     
+    def _run_compiled(self, inp, maxout, startspace, endspace, accelerate=False, tracer=None):
+        result, tape, steps = self.compile().run(inp, maxout, startspace, endspace, accelerate, tracer)
+        return result, self._merge_sapces(tape, startspace, endspace), steps
+
     def _merge_sapces(self, inp, startspace, endspace):
         """
         Merge more than one spaces into one space. For example:
@@ -196,33 +337,839 @@ class TM:
         return inp
 
 
-# The following TM simulates the process of doing addition
-# Number of ones represents the number, 0 represents the + sign
-# 1110111 => 3 + 3
-# Result: 111111 => 6
-
-# States
-q0 = State('q0')
-q1 = State('q1')
-q2 = State('q2')
-q3 = State('q3')
-q4 = State('q4')
-
-# Transition functions
-t1 = Transit('1', q0, q0, mv=R)
-t2 = Transit('0', q0, q1, '1', R)
-t3 = Transit('1', q1, q1, mv=R)
-t4 = Transit('_', q1, q2, mv=L)
-t5 = Transit('1', q2, q3, '_', L)
-t6 = Transit('1', q3, q3, mv=L)
-t7 = Transit('_', q3, q4, mv=R)
-
-# Setup the Turing Machine given a list of states and functions, as well as
-# the initial state and accepting state
-tm = TM([q0, q1, q2, q3, q4],
-    [t1, t2, t3, t4, t5, t6, t7],
-    q0, q4)
-
-# Run the machine on input 1110111(3+3), this algorithm requires starting space
-print(tm.run('1110111', trace=True, startspace=True))
-print(tm.observe())
+class CompiledTM:
+    """
+    A Turing Machine compiled for fast runs. States and symbols are numbered
+    and the transitions are stored in flat arrays indexed by
+    `state * len(symbols) + symbol`, the tape is a bytearray of symbol
+    numbers that grows in both directions when the head reaches an end. A
+    step is a few array lookups no matter how long the tape is.
+
+    `t`: A list of transition functions
+
+    `q0`: Initial state
+
+    `qa`: Accpeting state
+    """
+    def __init__(self, t, q0, qa):
+        self.states = [q0] if qa is q0 else [q0, qa]
+        self.symbols = ['_']
+        for f in t:
+            for state in (f.fs, f.ts):
+                if state not in self.states:
+                    self.states.append(state)
+            for ch in (f.ch, f.repl):
+                if ch and ch not in self.symbols:
+                    self.symbols.append(ch)
+        if len(self.symbols) > 256:
+            raise ValueError("At most 256 symbols are supported")
+        state_id = {state: i for i, state in enumerate(self.states)}
+        self.symbol_id = {ch: i for i, ch in enumerate(self.symbols)}
+        size = len(self.states) * len(self.symbols)
+        # -1 means no transition in next_state and no replacement in write
+        self.next_state = array('i', [-1] * size)
+        self.write = array('i', [-1] * size)
+        self.move = array('i', [0] * size)
+        for f in t:
+            i = state_id[f.fs] * len(self.symbols) + self.symbol_id[f.ch]
+            self.next_state[i] = state_id[f.ts]
+            if f.repl:
+                self.write[i] = self.symbol_id[f.repl]
+            self.move[i] = -1 if f.mv == L else 1 if f.mv == R else 0
+        # A sweep keeps the state and moves on while it reads the same
+        # symbol, e.g. q1 moving right over 1s
+        self.sweep = array('b', [
+            self.next_state[i] == i // len(self.symbols) and self.move[i] != 0 for i in range(size)
+        ])
+        self.start = 0
+        self.accept = state_id[qa]
+
+    def to_tables(self):
+        """
+        Return the compiled machine as plain data (names and lists of
+        numbers), see `from_tables`.
+        """
+        return {
+            "states": [str(state) for state in self.states],
+            "symbols": self.symbols,
+            "accept": self.accept,
+            "next_state": self.next_state.tolist(),
+            "write": self.write.tolist(),
+            "move": self.move.tolist(),
+        }
+
+    @classmethod
+    def from_tables(cls, tables):
+        """
+        Rebuild a compiled machine from the result of `to_tables`, with new
+        `State` objects named like the original ones.
+        """
+        compiled = cls.__new__(cls)
+        compiled.states = [State(name) for name in tables["states"]]
+        compiled.symbols = list(tables["symbols"])
+        compiled.symbol_id = {ch: i for i, ch in enumerate(compiled.symbols)}
+        size = len(compiled.states) * len(compiled.symbols)
+        compiled.next_state = array('i', tables["next_state"])
+        compiled.write = array('i', tables["write"])
+        compiled.move = array('i', tables["move"])
+        if not all(len(a) == size for a in (compiled.next_state, compiled.write, compiled.move)):
+            raise ValueError("The tables do not match the states and symbols")
+        compiled.sweep = array('b', [
+            compiled.next_state[i] == i // len(compiled.symbols) and compiled.move[i] != 0 for i in range(size)
+        ])
+        compiled.start = 0
+        compiled.accept = tables["accept"]
+        return compiled
+
+    def to_tm(self):
+        """
+        Return a `TM` with the transitions of the tables, already compiled
+        to this machine.
+        """
+        nsym = len(self.symbols)
+        moves = {-1: L, 0: N, 1: R}
+        t = []
+        for i, to in enumerate(self.next_state):
+            if to >= 0:
+                repl = self.symbols[self.write[i]] if self.write[i] >= 0 else None
+                t.append(Transit(self.symbols[i % nsym], self.states[i // nsym], self.states[to], repl,
+                                 moves[self.move[i]]))
+        tm = TM(list(self.states), t, self.states[self.start], self.states[self.accept])
+        tm._compiled = self
+        return tm
+
+    def run(self, inp, maxout=-1, startspace=False, endspace=True, accelerate=False, tracer=None):
+        """
+        Run the machine on the input, return the result in format
+        `(ACCEPT or REJECT, final tape, number of steps)`. The other arguments
+        are the same as in `TM.run`.
+
+        `accelerate`: Run sweeps (a state moving over a run of the same
+        symbol without changing state) in one macro step, and stop with
+        REJECT as soon as the machine is proven to never halt: a configuration
+        repeats (found with Brent's cycle detection), or a sweep over blanks
+        runs off the end of the tape. The number of steps still counts every
+        single step.
+
+        `tracer`: A `Tracer` recording the steps, `accelerate` is ignored
+        """
+        if endspace and not inp.endswith('_'):
+            inp = inp + '_'
+        pos = 0
+        if startspace:
+            if not inp.startswith('_'):
+                inp = '_' + inp
+            pos = 1
+        # Characters of the input without a transition get numbers past the
+        # table, reading them rejects
+        symbols = list(self.symbols)
+        symbol_id = dict(self.symbol_id)
+        for ch in set(inp):
+            if ch not in symbol_id:
+                symbol_id[ch] = len(symbols)
+                symbols.append(ch)
+        if len(symbols) > 256:
+            raise ValueError("At most 256 symbols are supported")
+        # Single byte characters are converted with translate tables, which
+        # is much faster than one character at a time on long inputs
+        single_byte = all(len(ch) == 1 and ord(ch) < 256 for ch in symbols)
+        if single_byte:
+            encode = bytearray(256)
+            for ch, i in symbol_id.items():
+                encode[ord(ch)] = i
+            tape = bytearray(inp.encode('latin-1').translate(encode))
+        else:
+            tape = bytearray(symbol_id[ch] for ch in inp)
+        tape.extend(bytes(max(pos + 1 - len(tape), 0)))
+        if tracer:
+            tracer.start([str(state) for state in self.states], symbols, bytes(tape), pos, self.start)
+            try:
+                result, tape, step = self._run_traced(tape, pos, maxout, tracer)
+            finally:
+                tracer.close()
+        elif accelerate:
+            result, tape, step = self._run_accelerated(tape, pos, maxout)
+        else:
+            result, tape, step = self._run(tape, pos, maxout)
+        if single_byte:
+            decode = bytes(ord(ch) for ch in symbols).ljust(256, b'_')
+            return result, tape.translate(decode).decode('latin-1'), step
+        return result, ''.join(symbols[b] for b in tape), step
+
+    def _run(self, tape, pos, maxout):
+        nsym = len(self.symbols)
+        next_state, write, move = self.next_state, self.write, self.move
+        state = self.start
+        accept = self.accept
+        step = 0
+        result = REJECT
+        while maxout < 0 or step < maxout:
+            if state == accept:
+                result = ACCEPT
+                break
+            sym = tape[pos]
+            if sym >= nsym:
+                break
+            i = state * nsym + sym
+            state = next_state[i]
+            if state < 0:
+                break
+            if write[i] >= 0:
+                tape[pos] = write[i]
+            pos += move[i]
+            # Double the tape on the side the head fell off
+            if pos < 0:
+                grow = len(tape)
+                tape[0:0] = bytes(grow)
+                pos += grow
+            elif pos == len(tape):
+                tape.extend(bytes(len(tape)))
+            step += 1
+        return result, tape, step
+
+    def _run_traced(self, tape, pos, maxout, tracer):
+        """
+        Same as `_run`, calling the tracer every `tracer.sample` steps and on
+        the last step.
+        """
+        nsym = len(self.symbols)
+        next_state, write, move = self.next_state, self.write, self.move
+        record = tracer.record
+        sample = tracer.sample
+        state = self.start
+        accept = self.accept
+        step = 0
+        origin = 0
+        result = REJECT
+        while maxout < 0 or step < maxout:
+            sym = tape[pos]
+            i = state * nsym + sym
+            if state == accept or sym >= nsym or next_state[i] < 0:
+                record(step, state, pos - origin, sym, -1)
+                if state == accept:
+                    result = ACCEPT
+                break
+            if step % sample == 0:
+                record(step, state, pos - origin, sym, write[i])
+            if write[i] >= 0:
+                tape[pos] = write[i]
+            state = next_state[i]
+            pos += move[i]
+            if pos < 0:
+                grow = len(tape)
+                tape[0:0] = bytes(grow)
+                pos += grow
+                origin += grow
+            elif pos == len(tape):
+                tape.extend(bytes(len(tape)))
+            step += 1
+        return result, tape, step
+
+    def _run_accelerated(self, tape, pos, maxout):
+        nsym = len(self.symbols)
+        next_state, write, move, sweep = self.next_state, self.write, self.move, self.sweep
+        state = self.start
+        accept = self.accept
+        step = 0
+        # Cells added on the left, pos - origin is the position on the tape
+        origin = 0
+        # Brent's cycle detection over macro steps: compare the configuration
+        # with the one saved at the last power of two
+        saved = None
+        power = 1
+        length = 0
+        while maxout < 0 or step < maxout:
+            if state == accept:
+                return ACCEPT, tape, step
+            sym = tape[pos]
+            if sym >= nsym:
+                break
+            i = state * nsym + sym
+            if sweep[i]:
+                d = move[i]
+                count = _run_length(tape, pos, sym, d)
+                # A sweep over blanks off the end of the tape never ends
+                if sym == 0 and (pos + d * count < 0 or pos + d * count >= len(tape)):
+                    break
+                if maxout >= 0:
+                    count = min(count, maxout - step)
+                if write[i] >= 0 and write[i] != sym:
+                    lo = pos if d > 0 else pos - count + 1
+                    tape[lo:lo + count] = bytes([write[i]]) * count
+                pos += d * count
+                step += count
+            else:
+                state = next_state[i]
+                if state < 0:
+                    break
+                if write[i] >= 0:
+                    tape[pos] = write[i]
+                pos += move[i]
+                step += 1
+            if pos < 0:
+                grow = len(tape)
+                tape[0:0] = bytes(grow)
+                pos += grow
+                origin += grow
+            elif pos == len(tape):
+                tape.extend(bytes(len(tape)))
+
+            if saved and saved[0] == state and saved[1] == pos - origin and saved[2:] == _contents(tape, origin):
+                break
+            length += 1
+            if length == power:
+                saved = (state, pos - origin) + _contents(tape, origin)
+                power *= 2
+                length = 0
+        return REJECT, tape, step
+
+
+def _run_length(tape, pos, sym, d):
+    """
+    Number of cells holding `sym` from `pos` in direction `d` (1 or -1),
+    reading chunks of doubling size so the cost follows the length of the
+    run and not of the tape.
+    """
+    value = bytes([sym])
+    count = 0
+    size = 16
+    while True:
+        if d > 0:
+            chunk = tape[pos + count:pos + count + size]
+            found = len(chunk) - len(chunk.lstrip(value))
+        else:
+            end = pos - count + 1
+            chunk = tape[max(end - size, 0):end]
+            found = len(chunk) - len(chunk.rstrip(value))
+        count += found
+        if found < size:
+            return count
+        size *= 2
+
+
+def _contents(tape, origin):
+    """
+    The non blank part of the tape and its position, so that tapes that only
+    differ in the blanks around them compare equal.
+    """
+    start = len(tape) - len(tape.lstrip(b'\0'))
+    return start - origin, bytes(tape).strip(b'\0')
+
+
+class MultiTransit:
+    """
+    A transition function of a machine with several tapes, it reads one
+    char on every tape, replaces them and moves every pointer.
+
+    `chs`: When these chars are read (one per tape), this function will be
+    triggered, e.g. `('1', '_')`
+
+    `fs`: From state
+
+    `ts`: To State
+
+    `repls`: Replacement of the char on every tape, None to keep it
+
+    `mvs`: Pointer movement on every tape
+    """
+    def __init__(self, chs, fs, ts, repls=None, mvs=None):
+        self.chs = tuple(chs)
+        self.fs = fs
+        self.ts = ts
+        self.repls = tuple(repls) if repls else (None,) * len(self.chs)
+        self.mvs = tuple(mvs) if mvs else (N,) * len(self.chs)
+
+    def __str__(self):
+        return "r"+str(list(self.chs)) +\
+                "fs["+str(self.fs)+"]"+\
+                "ts["+str(self.ts)+"]"+\
+                "rp"+str(list(self.repls))+\
+                "mv"+str(list(self.mvs))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class MultiTM:
+    """
+    Turing Machine with several tapes and a nondeterministic transition
+    relation: a state can have several transition functions for the same
+    chars. The machine accepts if any sequence of choices reaches the
+    accepting state.
+
+    The tapes are unbounded in both directions and every pointer starts at
+    the first char of its input.
+
+    `s`: A list of states
+
+    `t`: A list of `MultiTransit`
+
+    `q0`: Initial state
+
+    `qa`: Accpeting state
+
+    `tapes`: Number of tapes
+    """
+    def __init__(self, s, t, q0, qa, tapes=2):
+        smap = {}
+        for i in t:
+            if len(i.chs) != tapes or len(i.repls) != tapes or len(i.mvs) != tapes:
+                raise ValueError(f"Transition {i} does not have {tapes} tapes")
+            smap.setdefault(i.fs, {}).setdefault(i.chs, []).append(i)
+        self.smap = smap
+        self.t = t
+        self.q0 = q0
+        self.qa = qa
+        self.tapes = tapes
+        self.last = None
+
+    def run(self, inp, maxout=-1, max_frontier=100000, max_visited=100000):
+        """
+        Explore the runs of the machine breadth first, one step of every
+        run at a time. Return `ACCEPT` as soon as a run reaches the accepting
+        state, `REJECT` if every run is stuck or if a limit is reached.
+
+        While a single run is followed (no choice to make), it steps in
+        place and stops with REJECT when a configuration (state, tapes and
+        pointers) repeats, found with Brent's cycle detection like
+        `CompiledTM.run` with `accelerate`. Otherwise configurations seen in
+        the last steps are skipped, so a run that loops is dropped instead
+        of running forever as long as the loop is shorter than the memory of
+        `max_visited` configurations.
+
+        `inp`: The input string of the first tape, or a list of input strings
+        for the first tapes. The other tapes are blank.
+
+        `maxout`: Max steps that will be executed, if over the limit REJECT
+        immediately
+
+        `max_frontier`: Max configurations explored at the same step, if over
+        the limit REJECT immediately
+
+        `max_visited`: Max configurations remembered to skip the ones already
+        seen, the oldest steps are forgotten first
+        """
+        inputs = [inp] if isinstance(inp, str) else list(inp)
+        inputs = inputs + [''] * (self.tapes - len(inputs))
+        frontier = [(self.q0, [_Tape(i) for i in inputs])]
+        # Configurations seen in the last steps, and the ones of every step
+        # so the oldest can be forgotten
+        visited = set()
+        levels = deque()
+        # Brent's cycle detection while a single run is followed
+        saved = None
+        power = 1
+        length = 0
+        step = 0
+        while frontier:
+            if maxout >= 0 and step >= maxout:
+                return REJECT
+            for s, tapes in frontier:
+                if s == self.qa:
+                    self.last = tuple(tape.contents() for tape in tapes)
+                    return ACCEPT
+            if len(frontier) == 1:
+                s, tapes = frontier[0]
+                fs = self.smap.get(s, {}).get(tuple(tape.read() for tape in tapes), ())
+                if len(fs) == 1:
+                    f = fs[0]
+                    for tape, repl, mv in zip(tapes, f.repls, f.mvs):
+                        tape.apply(repl, mv)
+                    frontier = [(f.ts, tapes)]
+                    step += 1
+                    positions = tuple(tape.ptr - tape.origin for tape in tapes)
+                    # Only compare the tapes when the cheap parts match
+                    if saved and saved[0] == f.ts and saved[1] == positions and \
+                            saved[2] == tuple(tape.key() for tape in tapes):
+                        return REJECT
+                    length += 1
+                    if length == power:
+                        saved = (f.ts, positions, tuple(tape.key() for tape in tapes))
+                        power *= 2
+                        length = 0
+                    continue
+            saved = None
+            power = 1
+            length = 0
+            following = []
+            level = []
+            for s, tapes in frontier:
+                fs = self.smap.get(s, {}).get(tuple(tape.read() for tape in tapes), ())
+                for i, f in enumerate(fs):
+                    # The last choice reuses the tapes, the others get a copy
+                    following_tapes = tapes if i == len(fs) - 1 else [tape.copy() for tape in tapes]
+                    for tape, repl, mv in zip(following_tapes, f.repls, f.mvs):
+                        tape.apply(repl, mv)
+                    key = (f.ts,) + tuple((tape.ptr - tape.origin,) + tape.key() for tape in following_tapes)
+                    if key not in visited:
+                        visited.add(key)
+                        level.append(key)
+                        following.append((f.ts, following_tapes))
+            if len(following) > max_frontier:
+                return REJECT
+            levels.append(level)
+            while len(visited) > max_visited:
+                visited.difference_update(levels.popleft())
+            frontier = following
+            step += 1
+        return REJECT
+
+    def observe(self, tape=-1):
+        """
+        Observe the accepted result of the last run on the given tape
+        (default is the last one), remove spaces and only return the result.
+        Or return None if there is no result from last run.
+        """
+        return self.last[tape].replace('_', '') if self.last else None
+
+
+class _Tape:
+    """
+    One tape of a run of a `MultiTM`, the chars are kept in a list that
+    grows on the side the pointer falls off. `origin` is the number of cells
+    added on the left, so `ptr - origin` is the position of the pointer
+    relative to the first char of the input.
+    """
+    __slots__ = ("cells", "ptr", "origin")
+
+    def __init__(self, inp, ptr=0, origin=0):
+        self.cells = list(inp) or ['_']
+        self.ptr = ptr
+        self.origin = origin
+
+    def copy(self):
+        return _Tape(self.cells, self.ptr, self.origin)
+
+    def read(self):
+        return self.cells[self.ptr]
+
+    def apply(self, repl, mv):
+        """
+        Replace the char at the pointer (if `repl` is not None) and move it.
+        """
+        if repl is not None:
+            self.cells[self.ptr] = repl
+        if mv == L:
+            self.ptr = self.ptr - 1
+            if self.ptr < 0:
+                grow = len(self.cells)
+                self.cells[0:0] = ['_'] * grow
+                self.ptr = self.ptr + grow
+                self.origin = self.origin + grow
+        elif mv == R:
+            self.ptr = self.ptr + 1
+            if self.ptr == len(self.cells):
+                self.cells.extend(['_'] * len(self.cells))
+
+    def key(self):
+        """
+        The non blank part of the tape and its position, so that tapes that
+        only differ in the blanks around them compare equal.
+        """
+        text = ''.join(self.cells)
+        stripped = text.lstrip('_')
+        if not stripped:
+            return 0, ''
+        return len(text) - len(stripped) - self.origin, stripped.rstrip('_')
+
+    def contents(self):
+        return ''.join(self.cells).strip('_')
+
+
+class Tracer:
+    """
+    Records the steps of a compiled run (see `TM.run`) for later inspection,
+    without printing anything while the machine runs. Every record is
+    `(step, state, pointer, read, write)`: the numbers of the state and the
+    symbol read before the step, the position of the pointer relative to
+    the start of the input, and the number of the symbol written or -1.
+
+    The records are kept in `records` if no `path` is given, otherwise they
+    are written to the file, either as one JSON object per line or in a
+    compact binary format. The first line (or block) describes the run, so
+    `replay` can print the steps like `trace=True` does.
+
+    A tracer records a single run.
+
+    `path`: File the records are written to
+
+    `binary`: Write the binary format instead of JSON lines
+
+    `sample`: Only record one step out of `sample`, the last step is always
+    recorded
+
+    `last`: Only keep the last `last` records in a ring buffer, they are
+    written to the file at the end of the run
+
+    `buffer_size`: Number of records written to the file at once
+    """
+    MAGIC = b"TMTR"
+    RECORD = struct.Struct("<qiqhh")
+
+    def __init__(self, path=None, binary=False, sample=1, last=None, buffer_size=4096):
+        self.path = path
+        self.binary = binary
+        self.sample = sample
+        self.last = last
+        self.buffer_size = buffer_size
+        self.header = None
+        self.records = deque(maxlen=last) if last else []
+        self._file = None
+
+    def start(self, states, symbols, tape, pointer, state):
+        """
+        Called by the machine before the first step with the names of the
+        states and symbols, the initial tape (symbol numbers), the position
+        of the pointer and the number of the initial state.
+        """
+        self.header = {
+            "states": states,
+            "symbols": symbols,
+            "tape": list(tape),
+            "pointer": pointer,
+            "state": state,
+        }
+        if self.path:
+            self._file = open(self.path, "wb")
+            header = json.dumps(self.header).encode()
+            if self.binary:
+                self._file.write(self.MAGIC + struct.pack("<I", len(header)) + header)
+            else:
+                self._file.write(header + b"\n")
+
+    def record(self, step, state, pointer, read, write):
+        self.records.append((step, state, pointer, read, write))
+        if self._file and not self.last and len(self.records) >= self.buffer_size:
+            self._flush()
+
+    def close(self):
+        """
+        Called by the machine after the last step, write the records left.
+        """
+        if self._file:
+            self._flush()
+            self._file.close()
+            self._file = None
+
+    def _flush(self):
+        if self.binary:
+            self._file.write(b"".join(self.RECORD.pack(*r) for r in self.records))
+        else:
+            self._file.write("".join(
+                '{"step": %d, "state": %d, "pointer": %d, "read": %d, "write": %d}\n' % r
+                for r in self.records
+            ).encode())
+        self.records.clear()
+
+
+def load_trace(path):
+    """
+    Read a file written by a `Tracer`, return the result in format
+    `(header, records)`.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(Tracer.MAGIC):
+        start = len(Tracer.MAGIC) + 4
+        size, = struct.unpack_from("<I", data, len(Tracer.MAGIC))
+        header = json.loads(data[start:start + size])
+        records = list(Tracer.RECORD.iter_unpack(data[start + size:]))
+    else:
+        lines = data.decode().splitlines()
+        header = json.loads(lines[0])
+        records = []
+        for line in lines[1:]:
+            r = json.loads(line)
+            records.append((r["step"], r["state"], r["pointer"], r["read"], r["write"]))
+    return header, records
+
+
+def replay(trace):
+    """
+    Yield the recorded steps in the format printed by `TM.run` with
+    `trace=True`.
+
+    `trace`: A `Tracer` or the path of a file written by one
+
+    When steps are missing (sampling or a ring buffer), the cells that may
+    have changed in the meantime are shown as `?` until they are read again.
+    The pointer moves at most one cell per step, so after `g` missing steps
+    only the cells within `g` of the last known pointer may have changed.
+    """
+    if isinstance(trace, Tracer):
+        header, records = trace.header, trace.records
+    else:
+        header, records = load_trace(trace)
+    states, symbols = header["states"], header["symbols"]
+    # Cells by position relative to the start of the input, '?' if unknown
+    cells = {i: symbols[s] for i, s in enumerate(header["tape"])}
+    # The step and the position of the last known pointer
+    previous = -1
+    last = (0, header["pointer"])
+    complete = True
+    for step, state, pointer, read, write in records:
+        if step != previous + 1:
+            # Steps last[0] + 1 to step - 1 (or 0 to step - 1 at the
+            # start) may have written anywhere within reach of the pointer
+            reach = step - 1 - last[0]
+            lo, hi = min(cells), max(cells)
+            for i in range(max(last[1] - reach, lo), min(last[1] + reach, hi) + 1):
+                cells[i] = "?"
+            complete = False
+        cells[pointer] = symbols[read]
+        start = min(min(cells), pointer)
+        end = max(max(cells), pointer) + 1
+        tape = "".join(cells.get(i, "?") for i in range(start, end))
+        ptr = pointer - start
+        if complete:
+            # Keep a single blank at the end like the merged tape of TM.run
+            tape = (tape.rstrip('_') + '_').ljust(ptr + 1, '_')
+        yield " ".join([
+            'Config: ' + tape[:ptr] + "[" + states[state] + "]" + tape[ptr+1:],
+            'Input: ' + tape,
+            'Read: ' + tape[ptr],
+            'Pointer: ' + str(ptr),
+            'At State: ' + states[state],
+        ])
+        if write >= 0:
+            cells[pointer] = symbols[write]
+        previous = step
+        last = (step, pointer)
+
+
+def load_machine(path, cache_dir=CACHE_DIR):
+    """
+    Load a machine from a JSON file (see `TM.from_dict`), with its compiled
+    tables ready. The compiled tables are cached in `cache_dir` under the
+    SHA-256 of the file, so loading the same machine again skips parsing,
+    validating and compiling it. Set `cache_dir` to None to disable the
+    cache.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    cache_path = None
+    if cache_dir:
+        key = hashlib.sha256(b"%d:" % _CACHE_VERSION + data).hexdigest()
+        cache_path = os.path.join(cache_dir, key + ".json")
+        try:
+            with open(cache_path) as f:
+                return CompiledTM.from_tables(json.load(f)).to_tm()
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            # Missing or broken cache entry, build it again
+            pass
+    try:
+        machine = json.loads(data)
+    except ValueError as e:
+        raise ValueError(f"{path} is not valid JSON: {e}")
+    tm = TM.from_dict(machine)
+    tables = tm.compile().to_tables()
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so an interrupted run does not
+        # leave a broken cache behind
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(tables, f)
+        os.replace(tmp_path, cache_path)
+    return tm
+
+
+def save_machine(tm, path):
+    """
+    Write the description of the machine to a JSON file.
+    """
+    with open(path, "w") as f:
+        json.dump(tm.to_dict(), f, indent=2)
+        f.write("\n")
+
+
+# The machine and the run options of a worker process of TM.run_many
+_worker = {}
+
+
+def _init_worker(tm, options):
+    _worker['tm'] = tm
+    _worker['options'] = options
+
+
+def _run_worker(inp):
+    return (inp,) + _worker['tm']._run_compiled(inp, *_worker['options'])
+
+
+if __name__ == "__main__":
+    # The following TM simulates the process of doing addition
+    # Number of ones represents the number, 0 represents the + sign
+    # 1110111 => 3 + 3
+    # Result: 111111 => 6
+
+    # States
+    q0 = State('q0')
+    q1 = State('q1')
+    q2 = State('q2')
+    q3 = State('q3')
+    q4 = State('q4')
+
+    # Transition functions
+    t1 = Transit('1', q0, q0, mv=R)
+    t2 = Transit('0', q0, q1, '1', R)
+    t3 = Transit('1', q1, q1, mv=R)
+    t4 = Transit('_', q1, q2, mv=L)
+    t5 = Transit('1', q2, q3, '_', L)
+    t6 = Transit('1', q3, q3, mv=L)
+    t7 = Transit('_', q3, q4, mv=R)
+
+    # Setup the Turing Machine given a list of states and functions, as well as
+    # the initial state and accepting state
+    tm = TM([q0, q1, q2, q3, q4],
+        [t1, t2, t3, t4, t5, t6, t7],
+        q0, q4)
+
+    # Run the machine on input 1110111(3+3), this algorithm requires starting space
+    print(tm.run('1110111', trace=True, startspace=True))
+    print(tm.observe())
+
+    # Record the steps in a file instead of printing them, then print them
+    # back from the file
+    tm.run('1110111', trace=Tracer('addition.trace'), startspace=True)
+    for line in replay('addition.trace'):
+        print(line)
+    os.remove('addition.trace')
+
+    # The same machine loaded from its description in addition.json
+    adder = load_machine(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'addition.json'))
+    print(adder.run('1110111', startspace=True, fast=True), adder.observe())
+
+    # Check many inputs at once, each run stops after 1000 steps
+    for inp, result, tape, steps in tm.run_many(['1', '101', '11011', '1101x'], maxout=1000, startspace=True):
+        print(inp, "ACCEPT" if result == ACCEPT else "REJECT", tape.replace('_', ''), steps, "steps")
+
+    # Sweeps over the 1s take one macro step each in accelerated mode
+    print(tm.run('1' * 100000 + '0' + '1' * 100000, startspace=True, accelerate=True))
+
+    # The same addition with two tapes: copy the 1s of the first tape to the
+    # second one, skipping the 0. It takes one step per char instead of
+    # going back and forth
+    p0 = State('p0')
+    p1 = State('p1')
+    adder = MultiTM([p0, p1], [
+        MultiTransit(('1', '_'), p0, p0, (None, '1'), (R, R)),
+        MultiTransit(('0', '_'), p0, p0, mvs=(R, N)),
+        MultiTransit(('_', '_'), p0, p1),
+    ], p0, p1, tapes=2)
+    print(adder.run('1110111'))
+    print(adder.observe())
+
+    # A nondeterministic machine accepting the inputs containing 101: it
+    # guesses where 101 starts
+    n0 = State('n0')
+    n1 = State('n1')
+    n2 = State('n2')
+    n3 = State('n3')
+    finder = MultiTM([n0, n1, n2, n3], [
+        MultiTransit('0', n0, n0, mvs=(R,)),
+        MultiTransit('1', n0, n0, mvs=(R,)),
+        MultiTransit('1', n0, n1, mvs=(R,)),
+        MultiTransit('0', n1, n2, mvs=(R,)),
+        MultiTransit('1', n2, n3),
+    ], n0, n3, tapes=1)
+    print(finder.run('0011010'), finder.run('0011001'))
@@ -1,4 +1,9 @@
 import random
+import re
+import os
+import multiprocessing
+from collections import OrderedDict, namedtuple
+import numpy as np
 
 
 prob_table = {
@@ -73,12 +78,510 @@ def random_sampling(n, weight=1.0, observed={}):
     return result
 
 
+class Factor:
+    """
+    A table of numbers over some variables, used by variable elimination.
+
+    `variables`: A tuple of variable indices
+
+    `table`: An array with one axis per variable, in the same order
+    """
+    def __init__(self, variables, table):
+        self.variables = tuple(variables)
+        self.table = table
+
+    def multiply(self, other):
+        variables = self.variables + tuple(v for v in other.variables if v not in self.variables)
+        # einsum only accepts small labels, so relabel the variables locally
+        label = {v: i for i, v in enumerate(variables)}
+        table = np.einsum(
+            self.table, [label[v] for v in self.variables],
+            other.table, [label[v] for v in other.variables],
+            [label[v] for v in variables],
+        )
+        return Factor(variables, table)
+
+    def sum_out(self, var):
+        axis = self.variables.index(var)
+        return Factor(self.variables[:axis] + self.variables[axis+1:], self.table.sum(axis=axis))
+
+    def reduce(self, var, value):
+        """
+        Keep only the entries where `var` has the given value.
+        """
+        axis = self.variables.index(var)
+        return Factor(self.variables[:axis] + self.variables[axis+1:], np.take(self.table, value, axis=axis))
+
+    def __str__(self):
+        return f"Factor(variables={self.variables}, shape={self.table.shape})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class BayesNet:
+    """
+    A Bayesian network over discrete variables, compiled into dense arrays.
+
+    `parents`: A dict mapping every variable to the list of its parents
+
+    `cpts`: A dict mapping every variable to its conditional probability
+    table, itself a dict mapping a tuple of parent values (in the order of
+    `parents`) to the list of probabilities of every value of the variable.
+    For example the table of S in the network above is:
+        {(0,): [0.80, 0.20], (1,): [0.50, 0.50]}
+
+    The variables are sorted in topological order and every table is
+    compiled into an array indexed by the parent values and then the value
+    of the variable, i.e. `tables[i][c][s]` is `P(S=s|C=c)` if S is the
+    i-th variable.
+
+    `version` is increased every time a table changes, so results computed
+    from the network can tell when they are out of date.
+    """
+    def __init__(self, parents, cpts):
+        self.order = self._topological_order(parents)
+        self.index = {v: i for i, v in enumerate(self.order)}
+        self.parents = [[self.index[p] for p in parents[v]] for v in self.order]
+        self.cardinality = [len(next(iter(cpts[v].values()))) for v in self.order]
+        self.tables = [self._compile_cpt(v, cpts[v]) for v in self.order]
+        self.version = 0
+
+    @classmethod
+    def from_prob_table(cls, table):
+        """
+        Build the network from a flat table in the format of `prob_table`,
+        i.e. keys like "P(W=0|S=1,R=0)". Variable names are lowercased.
+        """
+        parents = {}
+        cpts = {}
+        for key, p in table.items():
+            match = re.fullmatch(r"P\((\w+)=(\d+)(?:\|(.*))?\)", key)
+            if not match:
+                raise ValueError(f"Invalid probability: {key}")
+            var = match.group(1).lower()
+            given = [g.split('=') for g in match.group(3).split(',')] if match.group(3) else []
+            parents[var] = [g[0].strip().lower() for g in given]
+            values = tuple(int(g[1]) for g in given)
+            dist = cpts.setdefault(var, {}).setdefault(values, [])
+            value = int(match.group(2))
+            dist.extend(0 for _ in range(value + 1 - len(dist)))
+            dist[value] = p
+        return cls(parents, cpts)
+
+    def set_cpt(self, var, cpt):
+        """
+        Replace the conditional probability table of `var`, in the same
+        format as in the constructor. The parents and the number of values
+        of the variable cannot change.
+        """
+        i = self.index[var]
+        if any(len(dist) != self.cardinality[i] for dist in cpt.values()):
+            raise ValueError(f"{var} has {self.cardinality[i]} values")
+        self.tables[i] = self._compile_cpt(var, cpt)
+        self.version += 1
+
+    def sample(self, n, weight=1.0, observed={}, rng=None):
+        """
+        Likelihood weighted sampling of all the variables at once, return a
+        columnar table: a dict with one array of values per variable and the
+        array of weights ('weight').
+
+        `observed`: A dict of observed values, the observed variables are set
+        to the given value and the weights are multiplied by its probability
+
+        `rng`: A numpy random Generator, a new one is created if not given
+        """
+        rng = rng or np.random.default_rng()
+        weights = np.full(n, weight, dtype=np.float64)
+        columns = []
+        for i, var in enumerate(self.order):
+            table = self.tables[i]
+            dtype = np.int8 if self.cardinality[i] <= 127 else np.int32
+            if self.parents[i]:
+                probs = table[tuple(columns[p] for p in self.parents[i])]
+            else:
+                probs = np.broadcast_to(table, (n, len(table)))
+            if var in observed:
+                value = observed[var]
+                weights = weights * probs[:, value]
+                columns.append(np.full(n, value, dtype=dtype))
+            else:
+                # Inverse transform: the value is the number of cumulative
+                # probabilities the uniform number is greater than
+                rand = rng.random(n)
+                cumulative = np.cumsum(probs[:, :-1], axis=1)
+                columns.append(np.sum(rand[:, None] > cumulative, axis=1).astype(dtype))
+        result = {var: columns[i] for i, var in enumerate(self.order)}
+        result['weight'] = weights
+        return result
+
+    def gibbs(self, n, evidence={}, chains=4, burn_in=1000, thin=1, rng=None):
+        """
+        Gibbs sampling given the evidence, return a columnar table like
+        `sample` with all the weights set to 1. Every chain keeps `n`
+        samples, the arrays hold the samples of the first chain, then the
+        second one, etc., so `columns[var].reshape(chains, n)` gives the
+        draws of every chain (see `effective_sample_size`).
+
+        Every step draws one variable given its Markov blanket (its parents,
+        its children and the other parents of its children) with the
+        observed variables fixed, so unlike likelihood weighting no sample
+        is wasted when the evidence is unlikely. All the chains are updated
+        at once with numpy. Raise ValueError if the evidence has zero
+        probability.
+
+        `burn_in`: Number of sweeps (one update of every variable) dropped
+        at the start of every chain
+
+        `thin`: Keep one sweep out of `thin`
+
+        `rng`: A numpy random Generator, a new one is created if not given
+        """
+        rng = rng or np.random.default_rng()
+        observed = {self.index[v] for v in evidence}
+        free = [i for i in range(len(self.order)) if i not in observed]
+        children = [[c for c, parents in enumerate(self.parents) if i in parents] for i in range(len(self.order))]
+        with np.errstate(divide='ignore'):
+            log_tables = [np.log(table) for table in self.tables]
+
+        # Start the chains from likelihood weighted samples drawn in
+        # proportion to their weights, so every chain starts in a state
+        # with a positive probability and every later state has one too
+        batch = max(1000, chains)
+        while True:
+            start = self.sample(batch, observed=evidence, rng=rng)
+            total = start['weight'].sum()
+            if total > 0:
+                break
+            # Keep drawing only if the evidence is possible but unlikely
+            if evidence and self.query(list(evidence))[tuple(evidence.values())] == 0:
+                raise ValueError("The evidence has zero probability")
+        picked = rng.choice(batch, chains, p=start['weight'] / total)
+        state = np.array([start[v][picked] for v in self.order], dtype=np.intp)
+        draws = np.empty((n, len(self.order), chains), dtype=np.intp)
+        for step in range(burn_in + n * thin):
+            for i in free:
+                values = np.arange(self.cardinality[i])
+                # log P(x_i | parents) + sum of log P(child | its parents)
+                # for every value of x_i, one row per chain
+                log_p = log_tables[i][tuple(state[p] for p in self.parents[i])]
+                log_p = np.broadcast_to(log_p, (chains, len(values)))
+                for c in children[i]:
+                    index = tuple(values if p == i else state[p][:, None] for p in self.parents[c])
+                    log_p = log_p + log_tables[c][index + (state[c][:, None],)]
+                top = log_p.max(axis=1, keepdims=True)
+                cumulative = np.cumsum(np.exp(log_p - top), axis=1)
+                rand = rng.random(chains) * cumulative[:, -1]
+                state[i] = np.sum(rand[:, None] >= cumulative[:, :-1], axis=1)
+            kept = step - burn_in
+            if kept >= 0 and kept % thin == 0:
+                draws[kept // thin] = state
+
+        result = {}
+        for i, var in enumerate(self.order):
+            dtype = np.int8 if self.cardinality[i] <= 127 else np.int32
+            result[var] = draws[:, i, :].T.reshape(-1).astype(dtype)
+        result['weight'] = np.ones(n * chains)
+        return result
+
+    def query(self, variables, evidence={}):
+        """
+        Exact inference by variable elimination. Return the distribution of
+        `variables` given the evidence, an array with one axis per variable
+        (in the given order), i.e. `query(['c'], {'r': 0, 'w': 1})[0]` is
+        P(C=0|R=0,W=1).
+
+        `evidence`: A dict of observed values, a query variable that is
+        observed has all the probability on its observed value
+        """
+        if any(v in evidence for v in variables):
+            rest = [v for v in variables if v not in evidence]
+            result = np.zeros([self.cardinality[self.index[v]] for v in variables])
+            result[tuple(evidence[v] if v in evidence else slice(None) for v in variables)] = self.query(rest, evidence)
+            return result
+        targets = [self.index[v] for v in variables]
+        observed = {self.index[v]: value for v, value in evidence.items()}
+        # Variables that are not ancestors of a target or an observed
+        # variable sum to 1 and can be dropped
+        relevant = self._ancestors(set(targets) | set(observed))
+        factors = []
+        for i in sorted(relevant):
+            factor = Factor(self.parents[i] + [i], self.tables[i])
+            for var, value in observed.items():
+                if var in factor.variables:
+                    factor = factor.reduce(var, value)
+            factors.append(factor)
+
+        hidden = relevant - set(targets) - set(observed)
+        while hidden:
+            var = self._next_to_eliminate(hidden, factors)
+            hidden.remove(var)
+            used = [f for f in factors if var in f.variables]
+            factors = [f for f in factors if var not in f.variables]
+            product = used[0]
+            for f in used[1:]:
+                product = product.multiply(f)
+            factors.append(product.sum_out(var))
+
+        result = Factor(targets, np.ones([self.cardinality[t] for t in targets]))
+        for f in factors:
+            result = result.multiply(f)
+        table = result.table
+        total = table.sum()
+        if total == 0:
+            raise ValueError("The evidence has zero probability")
+        return table / total
+
+    def probability(self, assignment, evidence={}):
+        """
+        Exact probability of the assignment (a dict of values) given the
+        evidence, e.g. `probability({'c': 0}, {'r': 0, 'w': 1})`.
+        """
+        variables = list(assignment)
+        return float(self.query(variables, evidence)[tuple(assignment[v] for v in variables)])
+
+    def _ancestors(self, variables):
+        result = set()
+        stack = list(variables)
+        while stack:
+            var = stack.pop()
+            if var not in result:
+                result.add(var)
+                stack.extend(self.parents[var])
+        return result
+
+    def _next_to_eliminate(self, hidden, factors):
+        """
+        Greedy min-fill heuristic: pick the variable whose elimination adds
+        the fewest new edges between its neighbours, breaking ties by the
+        size of the factor it creates.
+        """
+        best = None
+        for var in hidden:
+            scopes = [set(f.variables) for f in factors if var in f.variables]
+            neighbours = set().union(*scopes) - {var}
+            fill = 0
+            for a in neighbours:
+                for b in neighbours:
+                    if a < b and not any(a in s and b in s for s in scopes):
+                        fill += 1
+            size = 1
+            for n in neighbours:
+                size *= self.cardinality[n]
+            if best is None or (fill, size) < best[0]:
+                best = ((fill, size), var)
+        return best[1]
+
+    def _compile_cpt(self, var, cpt):
+        i = self.index[var]
+        shape = [self.cardinality[p] for p in self.parents[i]] + [self.cardinality[i]]
+        table = np.full(shape, np.nan)
+        for values, dist in cpt.items():
+            table[tuple(values)] = dist
+        if np.isnan(table).any():
+            raise ValueError(f"Incomplete probability table for {var}")
+        if not np.allclose(table.sum(axis=-1), 1):
+            raise ValueError(f"Probabilities of {var} do not sum to 1")
+        return table
+
+    @staticmethod
+    def _topological_order(parents):
+        order = []
+        done = set()
+        remaining = list(parents)
+        while remaining:
+            ready = [v for v in remaining if all(p in done for p in parents[v])]
+            if not ready:
+                raise ValueError("The network contains a cycle")
+            for v in ready:
+                order.append(v)
+                done.add(v)
+            remaining = [v for v in remaining if v not in done]
+        return order
+
+
+class SampleTable:
+    """
+    Weighted samples indexed for fast queries. The samples are read once to
+    build a joint histogram (the sum of the weights of every combination of
+    values), then every query is answered from the histogram without going
+    through the samples again.
+
+    `columns`: A columnar table as returned by `BayesNet.sample`, one array
+    of values per variable and the weights ('weight')
+
+    `variables`: The variables kept in the histogram, default is all of them.
+    The histogram has one entry per combination of values, so only keep the
+    variables used by the queries when there are many of them.
+
+    `cardinality`: A dict with the number of values of the variables, default
+    is the largest sampled value + 1
+    """
+    def __init__(self, columns, variables=None, cardinality=None):
+        self.variables = list(variables or [v for v in columns if v != 'weight'])
+        self.index = {v: i for i, v in enumerate(self.variables)}
+        cardinality = cardinality or {}
+        shape = tuple(cardinality.get(v, int(columns[v].max()) + 1) for v in self.variables)
+        # One pass: the flat position of every sample in the histogram
+        position = np.ravel_multi_index([columns[v].astype(np.intp) for v in self.variables], shape)
+        weights = columns.get('weight')
+        self.histogram = np.bincount(position, weights, minlength=int(np.prod(shape))).reshape(shape)
+        self.total = float(self.histogram.sum())
+
+    @classmethod
+    def from_rows(cls, rows, variables=('c', 's', 'r', 'w')):
+        """
+        Build the table from rows in the format of `random_sampling`, i.e.
+        `[c, s, r, w, weight]`.
+        """
+        array = np.asarray(rows, dtype=np.float64)
+        columns = {v: array[:, i].astype(np.intp) for i, v in enumerate(variables)}
+        columns['weight'] = array[:, len(variables)]
+        return cls(columns)
+
+    def weight(self, values):
+        """
+        Sum of the weights of the samples with the given values.
+        """
+        selector = [slice(None)] * len(self.variables)
+        for v, value in values.items():
+            selector[self.index[v]] = value
+        return float(self.histogram[tuple(selector)].sum())
+
+    def probability(self, target, evidence={}):
+        """
+        Estimate of P(target | evidence), both are dicts of values.
+        """
+        given = self.weight(evidence) if evidence else self.total
+        return self.weight({**evidence, **target}) / given if given else float('nan')
+
+    def probabilities(self, queries):
+        """
+        Answer many `(target, evidence)` queries at once, return the list of
+        estimates.
+        """
+        return [self.probability(target, evidence) for target, evidence in queries]
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class CachedInference:
+    """
+    Exact queries on a network with a bounded LRU cache of the results, for
+    programs asking the same queries over and over. The cache is keyed by
+    the query variables and the evidence, and is cleared automatically when
+    a table of the network changes (see `BayesNet.set_cpt`).
+
+    `net`: A `BayesNet`
+
+    `maxsize`: Maximum number of cached results, the least recently used
+    one is dropped first
+    """
+    def __init__(self, net, maxsize=128):
+        self.net = net
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._version = net.version
+        self.hits = 0
+        self.misses = 0
+
+    def query(self, variables, evidence={}):
+        """
+        Same as `BayesNet.query`, the returned array is read-only because it
+        is shared with the cache.
+        """
+        if self.net.version != self._version:
+            self._cache.clear()
+            self._version = self.net.version
+        key = (tuple(variables), frozenset(evidence.items()))
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        result = self.net.query(variables, evidence)
+        result.setflags(write=False)
+        self._cache[key] = result
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return result
+
+    def probability(self, assignment, evidence={}):
+        """
+        Same as `BayesNet.probability`, using the cache.
+        """
+        variables = list(assignment)
+        return float(self.query(variables, evidence)[tuple(assignment[v] for v in variables)])
+
+    def cache_info(self):
+        """
+        Return the hits, misses, maximum size and current size of the cache,
+        like `functools.lru_cache`.
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._cache))
+
+    def cache_clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def effective_sample_size(draws):
+    """
+    Effective sample size of MCMC draws, an array of shape (chains, n), e.g.
+    `(columns['c'] == 0).reshape(chains, n)` for the estimate of P(C=0).
+    Consecutive Gibbs samples are correlated, this is the number of
+    independent samples they are worth.
+
+    The autocorrelations of the chains are combined with the variance
+    between the chains and summed in pairs until a pair becomes negative
+    (Geyer's initial positive sequence).
+    """
+    draws = np.asarray(draws, dtype=np.float64)
+    chains, n = draws.shape
+    centered = draws - draws.mean(axis=1, keepdims=True)
+    # Autocovariance of every chain with the FFT, zero padded so the end of
+    # the chain does not wrap around to the start
+    size = 1 << (2 * n - 1).bit_length()
+    spectrum = np.fft.rfft(centered, size, axis=1)
+    autocov = np.fft.irfft(spectrum * np.conj(spectrum), size, axis=1)[:, :n] / n
+    within = autocov[:, 0].mean() * n / (n - 1)
+    between = draws.mean(axis=1).var(ddof=1) if chains > 1 else 0.0
+    variance = within * (n - 1) / n + between
+    if variance == 0:
+        return float(chains * n)
+    rho = 1 - (within - autocov.mean(axis=0)) / variance
+    total = 0.0
+    for t in range(1, n - 1, 2):
+        pair = rho[t] + rho[t + 1]
+        if pair < 0:
+            break
+        total += pair
+    return float(chains * n / (1 + 2 * total))
+
+
+network = BayesNet.from_prob_table(prob_table)
+
+
+def vectorized_sampling(n, weight=1.0, observed={}, rng=None):
+    """
+    Same as `random_sampling` but draws all n samples at once with numpy.
+    Return a columnar table, a dict with one array per variable ('c', 's',
+    'r' and 'w') and the array of weights ('weight').
+
+    `rng`: A numpy random Generator, a new one is created if not given
+    """
+    return network.sample(n, weight, observed, rng)
+
+
 def count(variables, table):
     indices = []
     for v in variables:
         if v == "c":
             indices.append((0, 'c'))
-        if v == "s":
+        elif v == "s":
             indices.append((1, 's'))
         elif v == "r":
             indices.append((2, 'r'))
@@ -96,22 +599,180 @@ def count(variables, table):
     return count_var
 
 
-table = random_sampling(10000)
-# P(R=1) = (# of rows in the table with R=1) / (# of rows)
-r = count({ "r": 1 }, table)
-print("P(R=1) = {0:.4f}".format(r/len(table)))
-# P(C=1, W=0) = (# of rows in the table with C=1, W=0) / (# of rows)
-cw = count({ "c": 1, "w": 0 }, table)
-print("P(C=1, W=0) = {0:.4f}".format(cw / len(table)))
-
-table = random_sampling(10000, observed={'r': 1})
-sm = sum(t[4] for t in table)
-# P(C=0) = (sum of rows with C=0 * w_row) /  (sum of all rows * w_row)
-c = count({"c": 0}, table)
-print("P(C=0) [observed R=1] = {0:.4f}".format(c/sm))
-
-table = random_sampling(10000, observed={'r': 0, 'w': 1})
-sm = sum(t[4] for t in table)
-# P(C=0) = (sum of rows with C=0 * w_row) /  (sum of all rows * w_row)
-c = count({"c": 0}, table)
-print("P(C=0) [observed R=0, W=1] = {0:.4f}".format(c/sm))
+def estimate(net, target, evidence={}, tolerance=1e-3, workers=None, batch_size=100000,
+             max_samples=None, min_samples=1000, seed=None):
+    """
+    Estimate P(target | evidence) by likelihood weighting in a pool of
+    worker processes, until the standard error of the estimate is below
+    `tolerance`. Return the result in format `(estimate, standard_error, samples)`.
+
+    Every task draws `batch_size` samples and only sends back running sums
+    of the weights, so the memory used does not grow with the number of
+    samples. Tasks are handed out in rounds of `workers` tasks and the sums
+    are combined in task order, so the result only depends on `seed`,
+    `workers` and `batch_size`.
+
+    `net`: A `BayesNet`
+
+    `target`, `evidence`: Dicts of values, e.g. `{'c': 0}` and `{'r': 1}`
+
+    `workers`: Number of processes, default is the number of CPUs. With 1
+    worker everything runs in the current process.
+
+    `max_samples`: Stop after this many samples even if the tolerance is
+    not reached
+
+    `min_samples`: Do not stop before the effective sample size (the number
+    of equally weighted samples worth as much as the weighted ones) reaches
+    this many. The standard error also never goes below the one of a
+    binomial estimate with 2 extra matches and misses, so a target that is
+    not sampled yet does not look certain.
+
+    Raise ValueError if the evidence has zero probability.
+
+    `seed`: Seed of the random streams. Every task gets its own independent
+    stream derived from the seed and the task number.
+    """
+    workers = workers or os.cpu_count()
+    # Fix the entropy once so every task stream is derived from the same root
+    root = np.random.SeedSequence(seed)
+    tasks = lambda start: [
+        (target, evidence, batch_size, np.random.SeedSequence(root.entropy, spawn_key=(start + i,)))
+        for i in range(workers)
+    ]
+    # n, sum of w, sum of w*y, sum of w^2, sum of w^2*y where y is 1 if
+    # the sample matches the target
+    sums = np.zeros(5)
+    pool = multiprocessing.Pool(workers, _init_sampling_worker, (net,)) if workers > 1 else None
+    if not pool:
+        _init_sampling_worker(net)
+    try:
+        start = 0
+        while True:
+            if pool:
+                results = pool.map(_weighted_sums, tasks(start))
+            else:
+                results = [_weighted_sums(task) for task in tasks(start)]
+            for result in results:
+                sums = sums + result
+            start = start + workers
+            if sums[1] == 0 and start == workers:
+                # No sample agrees with the evidence, check if it is possible
+                # at all before sampling forever
+                variables = list(evidence)
+                if net.query(variables)[tuple(evidence[v] for v in variables)] == 0:
+                    raise ValueError("The evidence has zero probability")
+            p, error, ess = _ratio_estimate(sums)
+            if (error < tolerance and ess >= min_samples) or (max_samples and sums[0] >= max_samples):
+                return p, error, int(sums[0])
+    finally:
+        if pool:
+            pool.terminate()
+
+
+def _ratio_estimate(sums):
+    """
+    Return the estimate, its standard error and the effective sample size.
+    """
+    n, w, wy, w2, w2y = sums
+    if w == 0:
+        return float('nan'), float('inf'), 0.0
+    p = float(wy / w)
+    ess = float(w * w / w2)
+    # Delta method variance of the ratio sum(w*y) / sum(w)
+    variance = (w2y * (1 - 2 * p) + p * p * w2) / (w * w)
+    # It is 0 when no sample (or every sample) matches the target, so keep
+    # at least the variance of a binomial estimate with 2 more matches and
+    # 2 more misses (Agresti-Coull)
+    adjusted = (p * ess + 2) / (ess + 4)
+    variance = max(variance, adjusted * (1 - adjusted) / (ess + 4))
+    return p, float(np.sqrt(variance)), ess
+
+
+# The network used by a sampling worker process, set by _init_sampling_worker
+_sampling_net = None
+
+
+def _init_sampling_worker(net):
+    global _sampling_net
+    _sampling_net = net
+
+
+def _weighted_sums(task):
+    target, evidence, n, seed = task
+    columns = _sampling_net.sample(n, observed=evidence, rng=np.random.default_rng(seed))
+    weights = columns['weight']
+    match = np.ones(n, dtype=bool)
+    for var, value in target.items():
+        match &= columns[var] == value
+    matched = weights[match]
+    return np.array([n, weights.sum(), matched.sum(), np.dot(weights, weights), np.dot(matched, matched)])
+
+
+if __name__ == "__main__":
+    table = random_sampling(10000)
+    # P(R=1) = (# of rows in the table with R=1) / (# of rows)
+    r = count({ "r": 1 }, table)
+    print("P(R=1) = {0:.4f}".format(r/len(table)))
+    # P(C=1, W=0) = (# of rows in the table with C=1, W=0) / (# of rows)
+    cw = count({ "c": 1, "w": 0 }, table)
+    print("P(C=1, W=0) = {0:.4f}".format(cw / len(table)))
+
+    table = random_sampling(10000, observed={'r': 1})
+    sm = sum(t[4] for t in table)
+    # P(C=0) = (sum of rows with C=0 * w_row) /  (sum of all rows * w_row)
+    c = count({"c": 0}, table)
+    print("P(C=0) [observed R=1] = {0:.4f}".format(c/sm))
+
+    table = random_sampling(10000, observed={'r': 0, 'w': 1})
+    sm = sum(t[4] for t in table)
+    # P(C=0) = (sum of rows with C=0 * w_row) /  (sum of all rows * w_row)
+    c = count({"c": 0}, table)
+    print("P(C=0) [observed R=0, W=1] = {0:.4f}".format(c/sm))
+
+    # Same queries with all the samples drawn at once, which makes a million
+    # samples as cheap as the 10000 above
+    columns = vectorized_sampling(1000000, observed={'r': 0, 'w': 1})
+    c = np.sum(columns['weight'][columns['c'] == 0])
+    print("P(C=0) [observed R=0, W=1, vectorized] = {0:.4f}".format(c / np.sum(columns['weight'])))
+
+    # Index the samples once, then all the queries are answered from the
+    # histogram instead of scanning the table again with count
+    samples = SampleTable(vectorized_sampling(1000000), cardinality={'c': 2, 's': 2, 'r': 2, 'w': 2})
+    estimates = samples.probabilities([
+        ({'r': 1}, {}),
+        ({'c': 1, 'w': 0}, {}),
+        ({'c': 0}, {'r': 1}),
+        ({'c': 0}, {'r': 0, 'w': 1}),
+    ])
+    print("P(R=1), P(C=1, W=0), P(C=0|R=1), P(C=0|R=0, W=1) [indexed] =",
+        ", ".join("{0:.4f}".format(p) for p in estimates))
+
+    # Exact answers by variable elimination, the sampled values above should be
+    # close to them
+    print("P(R=1) [exact] = {0:.4f}".format(network.probability({'r': 1})))
+    print("P(C=1, W=0) [exact] = {0:.4f}".format(network.probability({'c': 1, 'w': 0})))
+    print("P(C=0) [observed R=1, exact] = {0:.4f}".format(network.probability({'c': 0}, {'r': 1})))
+    print("P(C=0) [observed R=0, W=1, exact] = {0:.4f}".format(network.probability({'c': 0}, {'r': 0, 'w': 1})))
+
+    # Keep sampling in parallel until the standard error is below 0.0005
+    p, error, n = estimate(network, {'c': 0}, {'r': 0, 'w': 1}, tolerance=0.0005, seed=0)
+    print("P(C=0) [observed R=0, W=1, parallel] = {0:.4f} +- {1:.4f} after {2} samples".format(p, error, n))
+
+    # R=1 with W=0 is unlikely, most likelihood weights are close to 0.
+    # Gibbs samples always agree with the evidence
+    chains, n = 8, 2000
+    columns = network.gibbs(n, {'r': 1, 'w': 0}, chains=chains, burn_in=200, rng=np.random.default_rng(0))
+    c = columns['c'] == 0
+    print("P(C=0) [observed R=1, W=0, Gibbs] = {0:.4f}, effective sample size {1:.0f} of {2}".format(
+        np.mean(c), effective_sample_size(c.reshape(chains, n)), chains * n))
+    print("P(C=0) [observed R=1, W=0, exact] = {0:.4f}".format(network.probability({'c': 0}, {'r': 1, 'w': 0})))
+
+    # Repeated queries are answered from the cache until a table changes
+    inference = CachedInference(network)
+    for _ in range(100):
+        inference.probability({'c': 0}, {'r': 0, 'w': 1})
+    network.set_cpt('r', {(0,): [0.9, 0.1], (1,): [0.2, 0.8]})
+    print("P(C=0) [observed R=0, W=1, P(R=1|C=0) = 0.1, cached] = {0:.4f}".format(
+        inference.probability({'c': 0}, {'r': 0, 'w': 1})))
+    print(inference.cache_info())
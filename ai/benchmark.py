@@ -0,0 +1,253 @@
+"""
+Benchmark of the NeuralNet backends in neural_net.py against the Keras CNN
+in cnn_keras.py on growing, fixed subsets of MNIST.
+
+Every (configuration, train size) pair runs in its own process so the peak
+memory of one run does not leak into the next. For every run it records:
+1. samples per second during training
+2. time to accuracy, the training time until the test accuracy reaches
+the target (checked after every epoch, the evaluation is not timed)
+3. peak RSS of the process
+4. single sample inference latency percentiles
+
+The results are written to a JSON file together with the git commit, so
+runs can be compared across commits:
+
+    $ python benchmark.py --sizes 100 1000 10000 60000 --output results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from queue import Empty
+import numpy as np
+
+
+SIZES = [100, 1000, 10000, 60000]
+
+# name: (NeuralNet backend or "keras", learning rate, batch size, workers)
+CONFIGS = {
+    "python": ("python", 0.01, None, None),
+    "numpy": ("numpy", 0.01, None, None),
+    "numpy-batch": ("numpy", 0.5, 32, None),
+    "numpy-parallel": ("numpy", 0.5, 256, os.cpu_count()),
+    "keras-cnn": ("keras", None, 128, None),
+}
+
+
+def run_benchmark(config, size, epochs, target, test_size, latency_samples, seed):
+    """
+    Train and evaluate one configuration on the first `size` training
+    samples, return the measurements as a dict.
+    """
+    from mnist_data import load_mnist
+
+    (X_train, _, Y_train), (X_test, y_test, _) = load_mnist()
+    X_train, Y_train = X_train[:size], Y_train[:size]
+    X_test, y_test = X_test[:test_size], y_test[:test_size]
+    backend, alpha, batch_size, workers = CONFIGS[config]
+    if backend == "keras":
+        model = _KerasModel(batch_size)
+    else:
+        model = _NeuralNetModel(backend, alpha, batch_size, workers, seed)
+
+    train_seconds = 0
+    time_to_accuracy = None
+    accuracy = 0
+    start = time.perf_counter()
+
+    def end_epoch():
+        # Called between two epochs, the clock is stopped while evaluating
+        nonlocal train_seconds, time_to_accuracy, accuracy, start
+        train_seconds = train_seconds + time.perf_counter() - start
+        accuracy = float(np.mean(model.predict(X_test) == y_test))
+        if time_to_accuracy is None and accuracy >= target:
+            time_to_accuracy = train_seconds
+        start = time.perf_counter()
+
+    model.train(X_train, Y_train, epochs, end_epoch)
+
+    latencies = []
+    for x in X_test[:latency_samples]:
+        start = time.perf_counter()
+        model.predict_one(x)
+        latencies.append(time.perf_counter() - start)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+
+    return {
+        "config": config,
+        "size": size,
+        "epochs": epochs,
+        "train_seconds": train_seconds,
+        "samples_per_second": size * epochs / train_seconds,
+        "accuracy": accuracy,
+        "target_accuracy": target,
+        "time_to_accuracy": time_to_accuracy,
+        "peak_rss_mb": _peak_rss_mb(),
+        "latency_ms": {"p50": p50, "p90": p90, "p99": p99},
+    }
+
+
+class _NeuralNetModel():
+    def __init__(self, backend, alpha, batch_size, workers, seed):
+        from neural_net import NeuralNet
+
+        self.nn = NeuralNet(
+            NeuralNet.create_input(28*28),
+            [
+                NeuralNet.create_layer(10, "hyper")
+            ],
+            NeuralNet.get_loss(),
+            backend=backend,
+        )
+        self.nn.link()
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.workers = workers
+        self.seed = seed
+
+    def train(self, X, Y, epochs, end_epoch):
+        from neural_net import TrainingProfiler
+
+        # The python backend wants plain lists, like the original script
+        if self.nn.backend == "python":
+            X, Y = list(X), list(Y)
+        # All the epochs run in one call, so the worker pool and the shared
+        # memory of the parallel training are only set up once
+        profiler = TrainingProfiler(callback=lambda metrics: end_epoch())
+        # Keep the "After 1 epoch" lines out of the benchmark output
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.nn.train(X, Y, epochs, self.alpha, batch_size=self.batch_size, shuffle=self.batch_size is not None,
+                          seed=self.seed, workers=self.workers, profiler=profiler)
+
+    def predict(self, X):
+        return self.nn.predict_batch(X)[0]
+
+    def predict_one(self, x):
+        return self.nn.predict(x)
+
+
+class _KerasModel():
+    def __init__(self, batch_size):
+        from cnn_keras import build_model, input_shape
+
+        self.model = build_model()
+        self.batch_size = batch_size
+        self.input_shape = input_shape
+
+    def train(self, X, Y, epochs, end_epoch):
+        X = X.reshape(-1, *self.input_shape)
+        for _ in range(epochs):
+            self.model.fit(X, Y, batch_size=self.batch_size, epochs=1, verbose=0)
+            end_epoch()
+
+    def predict(self, X):
+        return np.argmax(self.model.predict(X.reshape(-1, *self.input_shape), verbose=0), axis=1)
+
+    def predict_one(self, x):
+        return np.argmax(self.model(x.reshape(1, *self.input_shape), training=False))
+
+
+def _peak_rss_mb():
+    # The worker pools of the parallel training are children of this process,
+    # RUSAGE_CHILDREN gives the largest of the ones that have ended
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _run_in_child(queue, args):
+    try:
+        queue.put(run_benchmark(*args))
+    except Exception as e:
+        queue.put({"config": args[0], "size": args[1], "error": repr(e)})
+
+
+def _wait_for_result(queue, process, config, size):
+    """
+    Wait for the result of a run, or return an error if its process died
+    without sending one (e.g. killed by the OOM killer).
+    """
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                break
+    # The result may have been sent right before the process exited
+    try:
+        return queue.get(timeout=1)
+    except Empty:
+        return {"config": config, "size": size, "error": f"Process exited with code {process.exitcode}"}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--target", type=float, default=0.85, help="Accuracy used for time to accuracy")
+    parser.add_argument("--test-size", type=int, default=10000)
+    parser.add_argument("--latency-samples", type=int, default=1000)
+    parser.add_argument("--python-max-size", type=int, default=1000,
+                        help="Skip larger sizes for the (very slow) python backend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    # A fresh process for every run keeps the peak RSS numbers separate
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for config in args.configs:
+        for size in args.sizes:
+            if config == "python" and size > args.python_max_size:
+                continue
+            queue = context.Queue()
+            run_args = (config, size, args.epochs, args.target, args.test_size, args.latency_samples, args.seed)
+            process = context.Process(target=_run_in_child, args=(queue, run_args))
+            process.start()
+            result = _wait_for_result(queue, process, config, size)
+            process.join()
+            results.append(result)
+            if "error" in result:
+                print(f"{config:>15} {size:>6}: {result['error']}")
+            else:
+                print(f"{config:>15} {size:>6}: {result['samples_per_second']:10.1f} samples/s, "
+                      f"accuracy {result['accuracy']:.4f}, peak RSS {result['peak_rss_mb']:.1f} MB, "
+                      f"p50 latency {result['latency_ms']['p50']:.3f} ms")
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "arguments": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to", args.output)
+
+
+if __name__ == "__main__":
+    main()
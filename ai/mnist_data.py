@@ -0,0 +1,125 @@
+"""
+The MNIST dataset, preprocessed once and cached on disk for the scripts
+in this folder.
+
+The first call downloads MNIST through keras, flattens and normalizes the
+images and one-hot encodes the labels, then saves the arrays as `.npy`
+files. Later calls memory-map those files, so loading is instant and the
+data is only read from disk when it is used.
+"""
+import os
+import queue
+import threading
+import numpy as np
+
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ideas-mnist")
+NUM_CLASSES = 10
+
+
+def load_mnist(cache_dir=CACHE_DIR):
+    """
+    Load MNIST, return the result in format
+    `(X_train, y_train, Y_train), (X_test, y_test, Y_test)`:
+    1. X, float32 array of shape (n, 784) with values in [0, 1]
+    2. y, uint8 array of shape (n,) with the labels
+    3. Y, uint8 array of shape (n, 10) with the one-hot encoded labels
+
+    All the arrays are read-only memory maps of the cached files.
+
+    `cache_dir`: Directory of the cached arrays
+    """
+    names = [f"{part}_{split}" for split in ("train", "test") for part in ("X", "y", "Y")]
+    paths = [os.path.join(cache_dir, name + ".npy") for name in names]
+    if not all(os.path.exists(path) for path in paths):
+        _build_cache(cache_dir)
+    arrays = [np.load(path, mmap_mode="r") for path in paths]
+    return tuple(arrays[:3]), tuple(arrays[3:])
+
+
+def batches(X, Y, batch_size, shuffle=False, seed=None, prefetch=0):
+    """
+    Yield `(X_batch, Y_batch)` pairs of `batch_size` rows, the last batch
+    can be smaller.
+
+    `shuffle`: Shuffle the rows before splitting them into batches
+
+    `seed`: Seed used for shuffling
+
+    `prefetch`: If greater than 0, prepare up to this many batches in a
+    background thread while the current one is being used
+    """
+    if prefetch > 0:
+        yield from _prefetch(batches(X, Y, batch_size, shuffle, seed), prefetch)
+        return
+    if shuffle:
+        order = np.random.default_rng(seed).permutation(len(X))
+    for start in range(0, len(X), batch_size):
+        if shuffle:
+            # Sorted indices read the memory map front to back
+            index = np.sort(order[start:start + batch_size])
+            yield np.asarray(X[index]), np.asarray(Y[index])
+        else:
+            yield np.asarray(X[start:start + batch_size]), np.asarray(Y[start:start + batch_size])
+
+
+def _build_cache(cache_dir):
+    from keras.datasets import mnist
+
+    os.makedirs(cache_dir, exist_ok=True)
+    (X_train, y_train), (X_test, y_test) = mnist.load_data()
+    for split, X, y in (("train", X_train, y_train), ("test", X_test, y_test)):
+        arrays = {
+            "X": X.reshape(len(X), -1).astype(np.float32) / 255,
+            "y": y.astype(np.uint8),
+            "Y": np.eye(NUM_CLASSES, dtype=np.uint8)[y],
+        }
+        for part, array in arrays.items():
+            path = os.path.join(cache_dir, f"{part}_{split}.npy")
+            # Write to a temporary file first so an interrupted run does
+            # not leave a broken cache behind
+            tmp_path = path + ".tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+
+
+def _prefetch(iterator, size):
+    """
+    Run `iterator` in a background thread, keeping up to `size` items ready.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up once the consumer is gone instead of blocking forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
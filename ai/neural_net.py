@@ -5,7 +5,15 @@ For learning purpose only.
 """
 import random
 import math
-from keras.datasets import mnist
+import json
+import os
+import struct
+import time
+import cProfile
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
 
 
 class Neuron():
@@ -15,24 +23,99 @@ class Neuron():
     2. output, the output of the neuron, AFTER running the activation function
     3. activation, a activation function
     4. (extra) the derivative of the activation function
+
+    The values are not stored in the neuron itself, a neuron is only a view on
+    one position of the arrays of its `Layer`.
+    """
+    __slots__ = ("layer", "index")
+
+    def __init__(self, layer, index):
+        self.layer = layer
+        self.index = index
+
+    @property
+    def input_(self):
+        return self.layer.input_[self.index]
+
+    @input_.setter
+    def input_(self, value):
+        self.layer.input_[self.index] = value
+
+    @property
+    def output(self):
+        return self.layer.output[self.index]
+
+    @output.setter
+    def output(self, value):
+        self.layer.output[self.index] = value
+
+    @property
+    def activation(self):
+        return self.layer.activation
+
+    @property
+    def deriv(self):
+        return self.layer.deriv
+
+    @property
+    def activation_lower(self):
+        return self.layer.activation_lower
+
+    @property
+    def activation_upper(self):
+        return self.layer.activation_upper
+
+    def activate(self):
+        self.output = self.activation(self.input_)
+        return self.output
+
+    def __str__(self):
+        return f"Neuron(input={self.input_}, output={self.output})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Layer():
     """
-    def __init__(self, input_, output, activation=None, deriv=None, activation_bounds=None):
-        self.input_ = input_
-        self.output = output
+    A layer of neurons. The inputs and outputs of all the neurons are
+    stored in two arrays, and all the neurons share one activation function:
+    1. input_, the inputs to the neurons
+    2. output, the outputs of the neurons, AFTER running the activation function
+    3. activation, a activation function
+    4. (extra) the derivative of the activation function
+    5. (extra) the name of the activation function, used by the numpy backend
+
+    Indexing or iterating a layer gives `Neuron` views.
+    """
+    def __init__(self, n, activation=None, deriv=None, activation_bounds=None, name=None):
+        self.input_ = np.zeros(n, dtype=np.float64)
+        self.output = np.zeros(n, dtype=np.float64)
         self.activation = activation
         self.deriv = deriv
+        self.name = name
         if activation_bounds:
             self.activation_lower, self.activation_upper = activation_bounds
         else:
             self.activation_upper = None
             self.activation_lower = None
-    
-    def activate(self):
-        self.output = self.activation(self.input_)
-        return self.output
+
+    def __len__(self):
+        return len(self.output)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index = index + len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Layer index out of range")
+        return Neuron(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Neuron(self, i)
 
     def __str__(self):
-        return f"Neuron(input={self.input_}, output={self.output})"
+        return f"Layer(size={len(self)}, activation={self.name})"
 
     def __repr__(self):
         return self.__str__()
@@ -41,9 +124,22 @@ class Neuron():
 class Input():
     """
     Input of the Neural Network, it should usually be preprocessed.
+
+    It is a view on one position of the array of its `InputLayer`.
     """
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ("layer", "index")
+
+    def __init__(self, layer, index):
+        self.layer = layer
+        self.index = index
+
+    @property
+    def value(self):
+        return self.layer.value[self.index]
+
+    @value.setter
+    def value(self, value):
+        self.layer.value[self.index] = value
 
     def __str__(self):
         return f"Input(value={self.value})"
@@ -52,34 +148,570 @@ class Input():
         return self.__str__()
 
 
+class InputLayer():
+    """
+    All inputs of the Neural Network stored in one array, indexing or
+    iterating it gives `Input` views.
+    """
+    def __init__(self, n):
+        self.value = np.zeros(n, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index = index + len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("InputLayer index out of range")
+        return Input(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Input(self, i)
+
+    def __str__(self):
+        return f"InputLayer(size={len(self)})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+# Layout of the file written by NeuralNet.save
+_MAGIC = b"NNET"
+_VERSION = 1
+_HEADER = struct.Struct("<4sII")
+_ALIGNMENT = 64
+
+
+def _align(position):
+    return (position + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class Activation():
+    """
+    An activation function and its derivative, registered by name in
+    `ACTIVATIONS`:
+    1. function, the scalar function used by the python backend
+    2. deriv, the scalar derivative used by the python backend, it takes the
+    OUTPUT of the function
+    3. vector_function, the same function working on whole numpy arrays
+    4. vector_deriv, the derivative working on whole numpy arrays, it takes
+    the output and the input (before the activation function)
+    5. bounds, the bounds of the output
+
+    `function` and `deriv` are None if the python backend does not support it.
+    """
+    def __init__(self, function, deriv, vector_function, vector_deriv, bounds, backward=None):
+        self.function = function
+        self.deriv = deriv
+        self.vector_function = vector_function
+        self.vector_deriv = vector_deriv
+        self.bounds = bounds
+        if backward:
+            self.backward = backward
+
+    def backward(self, error, output, input_):
+        """
+        Send the error of the output back through the function. It is the
+        element-wise product with the derivative unless the output depends on
+        more than one input, such as for softmax.
+        """
+        return self.vector_deriv(output, input_) * error
+
+
+def _sigmoid(x):
+    # Same as 1/(1 + e^-x) but does not overflow for large negative x
+    return 0.5 * (1 + math.tanh(0.5 * x))
+
+
+def _vector_sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+def _vector_softmax(x):
+    # Subtract the max to keep exp from overflowing
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+def _softmax_backward(error, output, input_):
+    # Jacobian of softmax is diag(y) - y y^T
+    return output * (error - np.sum(error * output, axis=-1, keepdims=True))
+
+
+# Constant of the tanh approximation of GELU
+_GELU_C = math.sqrt(2 / math.pi)
+
+
+def _vector_gelu(x):
+    return 0.5 * x * (1 + np.tanh(_GELU_C * (x + 0.044715 * x ** 3)))
+
+
+def _vector_gelu_deriv(output, input_):
+    t = np.tanh(_GELU_C * (input_ + 0.044715 * input_ ** 3))
+    return 0.5 * (1 + t) + 0.5 * input_ * (1 - t ** 2) * _GELU_C * (1 + 3 * 0.044715 * input_ ** 2)
+
+
+LEAKY_RELU_SLOPE = 0.01
+
+_relu = Activation(
+    lambda x: x if x > 0 else 0,
+    lambda x: 1 if x > 0 else 0,
+    lambda x: np.maximum(x, 0),
+    lambda y, x: (y > 0).astype(np.float64),
+    (0, 0),
+)
+_sigmoid_activation = Activation(
+    _sigmoid,
+    lambda x: x * (1 - x),
+    _vector_sigmoid,
+    lambda y, x: y * (1 - y),
+    (0, 1),
+)
+_tanh = Activation(
+    math.tanh,
+    lambda x: 1 - x ** 2,
+    np.tanh,
+    lambda y, x: 1 - y ** 2,
+    (-1, 1),
+)
+
+ACTIVATIONS = {
+    "relu": _relu,
+    "log": _sigmoid_activation,
+    "sigmoid": _sigmoid_activation,
+    "hyper": _tanh,
+    "tanh": _tanh,
+    "leaky_relu": Activation(
+        lambda x: x if x > 0 else LEAKY_RELU_SLOPE * x,
+        lambda x: 1 if x > 0 else LEAKY_RELU_SLOPE,
+        lambda x: np.where(x > 0, x, LEAKY_RELU_SLOPE * x),
+        lambda y, x: np.where(y > 0, 1.0, LEAKY_RELU_SLOPE),
+        (None, None),
+    ),
+    # The following ones need the whole layer or the input of the neuron,
+    # so only the numpy backend supports them
+    "softmax": Activation(None, None, _vector_softmax, None, (0, 1), _softmax_backward),
+    "gelu": Activation(None, None, _vector_gelu, _vector_gelu_deriv, (-0.17, None)),
+}
+
+
+def squared_error(actual, expected):
+    return (actual - expected) ** 2
+
+
+def feed_forward_batch(weights, activations, X, keep_outputs=False):
+    """
+    Feed every row of `X` through the layers, return the outputs of the
+    last layer. If `keep_outputs` is set, return `(outputs, inputs)` instead,
+    the outputs of `X` and of every layer and the inputs (before the
+    activation function) of every layer, `None` for `X`.
+    """
+    outputs = [X]
+    inputs = [None]
+    for i in range(len(weights)):
+        inputs.append(outputs[-1] @ weights[i])
+        outputs.append(activations[i](inputs[-1]))
+    return (outputs, inputs) if keep_outputs else outputs[-1]
+
+
+def batch_gradients(weights, activations, backwards, loss, X, y, profiler=None):
+    """
+    Run the forward and backward passes over a whole batch, return the
+    weight updates summed over the batch and the total loss.
+
+    `weights`: The weight matrix of every layer
+
+    `activations`: The vectorized activation function of every layer
+
+    `backwards`: The vectorized backward function of every layer, see
+    `NeuralNet.get_vector_backward`
+
+    `profiler`: An optional `TrainingProfiler` timing every pass
+    """
+    timer = profiler.time if profiler else _no_timer
+    with timer("feed_forward"):
+        outputs, inputs = feed_forward_batch(weights, activations, X, keep_outputs=True)
+    output = outputs[-1]
+    with timer("loss"):
+        score = float(np.sum(loss(y, output)))
+    with timer("back_propagation"):
+        delta = backwards[-1](y - output, output, inputs[-1])
+        gradients = [None for _ in weights]
+        for i in range(len(weights) - 1, -1, -1):
+            gradients[i] = outputs[i].T @ delta
+            if i > 0:
+                delta = backwards[i-1](delta @ weights[i].T, outputs[i], inputs[i])
+    return gradients, score
+
+
+def _no_timer(section):
+    return contextlib.nullcontext()
+
+
+class TrainingProfiler():
+    """
+    Opt-in instrumentation of `NeuralNet.train`, pass it as `profiler`. It
+    records:
+    1. times, the wall time spent in every section of the training, such as
+    "feed_forward", "loss" and "back_propagation"
+    2. updates, the number of weight updates (one per sample, or one per
+    batch with mini-batch training)
+    3. update_norms, for mini-batch training, the sum of the norms of the
+    weight updates of every layer, e.g. a layer whose weights barely move
+    has a much smaller norm than the others
+    4. epochs, one dict of metrics per epoch (loss, seconds, samples,
+    samples per second, the section times, the updates and update norms
+    so far)
+
+    `callback`: A function called with the metrics dict after every epoch
+
+    `cprofile`: Also run cProfile while training, see `dump`
+    """
+    def __init__(self, callback=None, cprofile=False):
+        self.callback = callback
+        self.times = {}
+        self.updates = 0
+        self.update_norms = []
+        self.samples = 0
+        self.epochs = []
+        self._profile = cProfile.Profile() if cprofile else None
+        self._depth = 0
+        self._epoch_start = None
+        self._epoch_times = {}
+
+    @contextlib.contextmanager
+    def time(self, section):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[section] = self.times.get(section, 0) + elapsed
+            self._epoch_times[section] = self._epoch_times.get(section, 0) + elapsed
+
+    @contextlib.contextmanager
+    def running(self):
+        """
+        Profile the training, nested calls only count once.
+        """
+        if self._depth == 0:
+            self._epoch_start = time.perf_counter()
+            self._epoch_times = {}
+            if self._profile:
+                self._profile.enable()
+        self._depth = self._depth + 1
+        try:
+            yield self
+        finally:
+            self._depth = self._depth - 1
+            if self._depth == 0 and self._profile:
+                self._profile.disable()
+
+    def count_updates(self, n=1, norms=None):
+        """
+        Count `n` weight updates. `norms`: The norm of the update of every
+        layer, if known.
+        """
+        self.updates = self.updates + n
+        if norms is not None:
+            if len(self.update_norms) < len(norms):
+                self.update_norms = self.update_norms + [0.0] * (len(norms) - len(self.update_norms))
+            for i, norm in enumerate(norms):
+                self.update_norms[i] = self.update_norms[i] + float(norm)
+
+    def end_epoch(self, epoch, average_loss, samples):
+        now = time.perf_counter()
+        seconds = now - self._epoch_start
+        metrics = {
+            "epoch": epoch,
+            "loss": float(average_loss),
+            "seconds": seconds,
+            "samples": samples,
+            "samples_per_second": samples / seconds if seconds > 0 else float("inf"),
+            "times": dict(self._epoch_times),
+            "updates": self.updates,
+            "update_norms": list(self.update_norms),
+        }
+        self.samples = self.samples + samples
+        self.epochs.append(metrics)
+        self._epoch_start = now
+        self._epoch_times = {}
+        if self.callback:
+            self.callback(metrics)
+        return metrics
+
+    def dump(self, path):
+        """
+        Write the cProfile statistics to `path` in the pstats format, which
+        can be read by `pstats`, snakeviz or turned into a flame graph with
+        flameprof. Requires `cprofile=True`.
+        """
+        if not self._profile:
+            raise ValueError("The profiler was created without cprofile=True")
+        self._profile.dump_stats(path)
+
+    def __str__(self):
+        total = sum(self.times.values())
+        sections = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in self.times.items())
+        return f"TrainingProfiler(epochs={len(self.epochs)}, samples={self.samples}, total={total:.3f}s, {sections})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _share_arrays(arrays):
+    """
+    Copy the arrays into one shared memory block, return the block and
+    `(offset, shape, dtype)` of every array so other processes can attach.
+    """
+    specs = []
+    size = 0
+    for array in arrays:
+        # Keep every array 8 bytes aligned
+        size = (size + 7) // 8 * 8
+        specs.append((size, array.shape, array.dtype.str))
+        size = size + array.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for array, shared in zip(arrays, _attach_arrays(shm, specs)):
+        shared[...] = array
+    return shm, specs
+
+
+def _attach_arrays(shm, specs):
+    return [np.ndarray(shape, dtype, buffer=shm.buf, offset=offset) for offset, shape, dtype in specs]
+
+
+# State of a training worker process, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(name, specs, activation_names, loss):
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = _attach_arrays(shm, specs)
+    _worker["shm"] = shm
+    _worker["X"], _worker["y"], _worker["weights"] = arrays[0], arrays[1], arrays[2:]
+    _worker["activations"] = [NeuralNet.get_vector_activation(n) for n in activation_names]
+    _worker["backwards"] = [NeuralNet.get_vector_backward(n) for n in activation_names]
+    _worker["loss"] = loss
+
+
+def _worker_gradients(index):
+    X = np.asarray(_worker["X"][index], dtype=np.float64)
+    y = np.asarray(_worker["y"][index], dtype=np.float64)
+    return batch_gradients(_worker["weights"], _worker["activations"], _worker["backwards"], _worker["loss"], X, y)
+
+
 class NeuralNet():
     """
     A neural network contains:
     1. Inputs
     2. One or multiple layers
     3. A loss function to evaluate the network score
+    4. (extra) a backend, either "python" or "numpy"
+
+    The "python" backend loops over every neuron and every weight, it is slow
+    but easy to follow. The "numpy" backend keeps the weights of each layer in
+    one matrix and runs the forward and backward passes as matrix operations
+    on the arrays of the layers.
     """
-    def __init__(self, inputs, layers, loss):
+    def __init__(self, inputs, layers, loss, backend="python"):
+        if backend not in ("python", "numpy"):
+            raise ValueError(f"Unknown backend: {backend}")
         self.inputs = inputs
         self.layers = layers
         self.weights = []
         self.weight_size = 0
         self.loss = loss
+        self.backend = backend
+        self.epochs_trained = 0
         self.errors = [0 for _ in layers[-1]]
-        self.outputs = [0 for _ in layers[-1]]
+        self.outputs = list(layers[-1])
+        self._vector_activations = [self.get_vector_activation(layer.name) for layer in layers]
+        self._vector_backwards = [self.get_vector_backward(layer.name) for layer in layers]
+        if backend == "python":
+            for layer in layers:
+                if layer.activation is None or layer.deriv is None:
+                    raise ValueError(f"Activation {layer.name} is only supported by the numpy backend")
     
-    def train(self, X_train, y_train, epoch, alpha):
-        for i in range(epoch):
-            score = 0
-            for index in range(len(X_train)):
-                x = X_train[index]
-                y = y_train[index]
-                self.feed_forward(x)
-                score = score + self.evaluate(y)
-                self.back_propagation(y, alpha)
-            print("After", i+1, "epoch, average loss:", score / len(X_train))
+    def train(self, X_train, y_train, epoch, alpha, batch_size=None, shuffle=False, seed=None, workers=None,
+              checkpoint=None, checkpoint_every=1, profiler=None):
+        """
+        Train the network on the given data.
+
+        `batch_size`: If given, the samples are fed as mini-batches of this size
+        and the weights are updated once per batch using the averaged gradient.
+        Only supported by the numpy backend.
+
+        `shuffle`: Shuffle the samples before every epoch
+
+        `seed`: Seed used for shuffling
+
+        `workers`: If given, every mini-batch is split across this many worker
+        processes. The workers compute the gradients against a shared memory
+        copy of the weights and the results are summed into one update, so
+        the run matches a single process run with the same `seed`, up to
+        floating point rounding. Requires `batch_size`.
+
+        `checkpoint`: If given, save the network to this path every
+        `checkpoint_every` epochs. A crashed run can be resumed by loading the
+        checkpoint with `NeuralNet.load` and training it for the remaining
+        `epoch - nn.epochs_trained` epochs.
+
+        `profiler`: A `TrainingProfiler` recording where the time goes
+        """
+        if len(X_train) == 0:
+            raise ValueError("No training samples")
+        rng = np.random.default_rng(seed)
+        if workers is not None:
+            if batch_size is None:
+                raise ValueError("Parallel training requires a batch_size")
+            return self._train_parallel(X_train, y_train, epoch, alpha, batch_size, shuffle, rng, workers,
+                                        checkpoint, checkpoint_every, profiler)
+        if batch_size is not None:
+            # Batches are converted to float64 one at a time, so a memory-mapped
+            # dataset is never loaded as a whole
+            X_train = np.asarray(X_train)
+            y_train = np.asarray(y_train)
+            return self.train_batches(
+                lambda: self.iterate_batches(X_train, y_train, batch_size, shuffle, rng),
+                epoch,
+                alpha,
+                checkpoint,
+                checkpoint_every,
+                profiler,
+            )
+        with (profiler.running() if profiler else contextlib.nullcontext()):
+            timer = profiler.time if profiler else _no_timer
+            for i in range(epoch):
+                score = 0
+                order = rng.permutation(len(X_train)) if shuffle else range(len(X_train))
+                for index in order:
+                    x = X_train[index]
+                    y = y_train[index]
+                    with timer("feed_forward"):
+                        self.feed_forward(x)
+                    with timer("loss"):
+                        score = score + self.evaluate(y)
+                    with timer("back_propagation"):
+                        self.back_propagation(y, alpha)
+                if profiler:
+                    profiler.count_updates(len(X_train))
+                self._end_epoch(i, score / len(X_train), len(X_train), checkpoint, checkpoint_every, profiler)
+
+    def train_batches(self, batches, epoch, alpha, checkpoint=None, checkpoint_every=1, profiler=None):
+        """
+        Train the network on a stream of mini-batches, useful when the
+        dataset does not fit in memory. Only supported by the numpy backend.
+
+        `batches`: An iterable of `(X_batch, y_batch)` pairs, or a function
+        returning such an iterable. Use a function if the batches come from
+        a generator, it will be called once per epoch. An iterator can only
+        be used for a single epoch.
+
+        `checkpoint`, `profiler`: Same as in `train`
+        """
+        if self.backend != "numpy":
+            raise ValueError("Mini-batch training requires the numpy backend")
+        if epoch > 1 and not callable(batches) and iter(batches) is batches:
+            raise ValueError("An iterator of batches can only be used for one epoch, pass a function returning it")
+        with (profiler.running() if profiler else contextlib.nullcontext()):
+            timer = profiler.time if profiler else _no_timer
+            for i in range(epoch):
+                score = 0
+                total = 0
+                for X_batch, y_batch in (batches() if callable(batches) else batches):
+                    X_batch = np.asarray(X_batch, dtype=np.float64)
+                    y_batch = np.asarray(y_batch, dtype=np.float64)
+                    gradients, batch_score = self._batch_gradients(X_batch, y_batch, profiler)
+                    with timer("update"):
+                        for weights, gradient in zip(self.weights, gradients):
+                            weights += alpha / len(X_batch) * gradient
+                    if profiler:
+                        profiler.count_updates(norms=[alpha / len(X_batch) * np.linalg.norm(g) for g in gradients])
+                    score = score + batch_score
+                    total = total + len(X_batch)
+                if total == 0:
+                    raise ValueError(f"No batches in epoch {i + 1}")
+                self._end_epoch(i, score / total, total, checkpoint, checkpoint_every, profiler)
+
+    def save(self, path):
+        """
+        Save the topology, the activation names and the weights to `path`.
+
+        The file starts with a header (magic, version, header length and a
+        JSON description of the network), followed by the raw float64 weight
+        matrices, each aligned to 64 bytes so they can be memory-mapped. The
+        file is written to a temporary file first and then renamed, so a crash
+        never leaves a half written checkpoint behind.
+        """
+        weights = [np.ascontiguousarray(w, dtype="<f8") for w in self.weights]
+        header = {
+            "backend": self.backend,
+            "inputs": len(self.inputs),
+            "layers": [{"size": len(layer), "activation": layer.name} for layer in self.layers],
+            "epochs_trained": self.epochs_trained,
+            "weights": [],
+        }
+        # Offsets are relative to the (aligned) end of the header
+        position = 0
+        for w in weights:
+            header["weights"].append({"offset": position, "shape": list(w.shape)})
+            position = _align(position + w.nbytes)
+        encoded = json.dumps(header).encode()
+        start = _align(_HEADER.size + len(encoded))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(encoded)))
+            f.write(encoded)
+            for w, spec in zip(weights, header["weights"]):
+                f.write(b"\0" * (start + spec["offset"] - f.tell()))
+                f.write(w.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True, loss=None):
+        """
+        Load a network saved by `save`.
+
+        `mmap`: Memory-map the weights instead of reading them. The weights are
+        mapped copy-on-write, so several processes loading the same file share
+        one physical copy until one of them trains the network. Ignored for
+        the python backend, which copies the weights into nested lists.
+
+        `loss`: The loss function, default is `get_loss()`
+        """
+        with open(path, "rb") as f:
+            magic, version, length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"Not a NeuralNet file: {path}")
+            header = json.loads(f.read(length))
+        start = _align(_HEADER.size + length)
+        nn = cls(
+            cls.create_input(header["inputs"]),
+            [cls.create_layer(layer["size"], layer["activation"]) for layer in header["layers"]],
+            loss or cls.get_loss(),
+            backend=header["backend"],
+        )
+        for spec in header["weights"]:
+            shape = tuple(spec["shape"])
+            offset = start + spec["offset"]
+            if mmap:
+                weights = np.memmap(path, dtype="<f8", mode="c", offset=offset, shape=shape)
+            else:
+                weights = np.fromfile(path, dtype="<f8", count=int(np.prod(shape)), offset=offset).reshape(shape)
+            nn.weights.append(weights)
+        nn.weight_size = sum(w.size for w in nn.weights)
+        if nn.backend == "python":
+            # The python backend works on nested lists
+            nn.weights = [w.tolist() for w in nn.weights]
+        nn.epochs_trained = header["epochs_trained"]
+        return nn
 
     def link(self, init_weight=0, rand_weight_range=None):
+        if self.backend == "numpy":
+            return self._link_numpy(init_weight, rand_weight_range)
         # Link inputs with the first layer
         first_weights = [[self._initialize_weight(init_weight, rand_weight_range) for _ in self.layers[0]] for _ in self.inputs]
         self.weights.append(first_weights)
@@ -94,117 +726,148 @@ class NeuralNet():
         return self.weights
 
     def feed_forward(self, input_values):
-        # Setup inputs values
-        for index in range(len(input_values)):
-            self.inputs[index].value = input_values[index]
-
-        # Feed inputs into the first layer, loop in layer -> input order
-        # to help activate a neuron after feeding all the values
-        for index in range(len(self.layers[0])):
-            neuron = self.layers[0][index]
-            neuron_input_value = 0
-            for jindex in range(len(self.inputs)):
-                weight = self.weights[0][jindex][index]
-                neuron_input_value = neuron_input_value + weight * self.inputs[jindex].value
-            neuron.input_ = neuron_input_value
-            neuron.activate()
-
-        # Feed the rest of the layers
-        layer_index = 0
-        while layer_index + 1 < len(self.layers):
-            layer = self.layers[layer_index]
-            next_layer = self.layers[layer_index + 1]
-            for index in range(len(next_layer)):
-                neuron = next_layer[index]
+        if self.backend == "numpy":
+            return self._feed_forward_numpy(input_values)
+        # Setup inputs values, the loops below work on plain lists since
+        # indexing the numpy arrays one value at a time is slow
+        self.inputs.value[:] = input_values
+        values = self.inputs.value.tolist()
+
+        # Feed the values layer by layer, loop in neuron -> previous neuron
+        # order to help activate a neuron after feeding all the values
+        for layer_index, layer in enumerate(self.layers):
+            weights = self.weights[layer_index]
+            activation = layer.activation
+            layer_inputs = [0] * len(layer)
+            layer_outputs = [0] * len(layer)
+            for index in range(len(layer)):
                 neuron_input_value = 0
-                for jindex in range(len(layer)):
-                    weight = self.weights[layer_index + 1][jindex][index]
-                    neuron_input_value = neuron_input_value + weight * layer[jindex].output
-                neuron.input_ = neuron_input_value
-                neuron.activate()
-            layer_index = layer_index + 1
-
-        # Update outputs
-        for i in range(len(self.layers[-1])):
-            self.outputs[i] = self.layers[-1][i]
+                for jindex in range(len(values)):
+                    neuron_input_value = neuron_input_value + weights[jindex][index] * values[jindex]
+                layer_inputs[index] = neuron_input_value
+                layer_outputs[index] = activation(neuron_input_value)
+            layer.input_[:] = layer_inputs
+            layer.output[:] = layer_outputs
+            values = layer_outputs
         return self.outputs
     
     def predict(self, input_values):
         self.feed_forward(input_values)
         return self.classify()
 
+    def predict_batch(self, X, chunk_size=1024):
+        """
+        Predict every row of the 2D array `X` in one vectorized pass, return
+        the result in format `(indices, scores)`, two arrays holding the
+        predicted class and its output value for every row.
+
+        Unlike `predict` it does not write into the inputs or the layers, so
+        it can be called from several threads at the same time (as long as
+        the network is not being trained).
+
+        `chunk_size`: Number of rows fed at once, bounds the memory used for
+        large (or memory-mapped) test sets
+        """
+        weights = [np.asarray(w, dtype=np.float64) for w in self.weights]
+        indices = np.empty(len(X), dtype=np.intp)
+        scores = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), chunk_size):
+            chunk = np.asarray(X[start:start + chunk_size], dtype=np.float64)
+            output = feed_forward_batch(weights, self._vector_activations, chunk)
+            index = np.argmax(output, axis=1)
+            indices[start:start + len(chunk)] = index
+            scores[start:start + len(chunk)] = output[np.arange(len(chunk)), index]
+        return indices, scores
+
+    def predict_stream(self, chunks):
+        """
+        Same as `predict_batch` for a test set that comes in chunks, for
+        example from a generator. Yield `(indices, scores)` for every chunk.
+        """
+        for chunk in chunks:
+            yield self.predict_batch(chunk, chunk_size=len(chunk))
+
     def classify(self):
         max_val = 0
         max_index = 0
-        for i in range(len(self.outputs)):
-            output = self.outputs[i]
-            if output.output > max_val:
-                max_val = output.output
+        for i, output in enumerate(self.layers[-1].output.tolist()):
+            if output > max_val:
+                max_val = output
                 max_index = i
         return max_index, max_val
 
     def evaluate(self, expected_values):
         total = 0
-        for i in range(len(self.outputs)):
-            total = total + self.loss(expected_values[i], self.outputs[i].output)
+        for expected, output in zip(expected_values, self.layers[-1].output.tolist()):
+            total = total + self.loss(expected, output)
         return total
 
     def back_propagation(self, expected_values, alpha):
+        if self.backend == "numpy":
+            return self._back_propagation_numpy(expected_values, alpha)
         # At least one hidden layer in the network
         if len(self.layers) > 1:
             # ==========================================================
             # I wrote them once and suprisingly there were no errors! :O
             # I cannot guarantee if the following codes are correct :D
             # ==========================================================
-            prev_layer = self.layers[-2]
+            # Work on plain lists of the outputs, see feed_forward
+            outputs = [layer.output.tolist() for layer in self.layers]
+            output_layer = self.layers[-1]
+            prev_outputs = outputs[-2]
+            last_weights = self.weights[-1]
             # Hidden layer to outputs error
-            track_err = [0 for _ in range(len(self.outputs))]
-            track_weight = [[0 for _ in range(len(self.outputs))] for _ in range(len(prev_layer))]
+            track_err = [0 for _ in range(len(output_layer))]
+            track_weight = [[0 for _ in range(len(output_layer))] for _ in range(len(prev_outputs))]
             # For each neuron in the output layer
-            for index in range(len(self.outputs)):
-                output_neuron = self.outputs[index]
+            for index, output in enumerate(outputs[-1]):
                 # error_obj: The objective error, (T_j - O_j)
-                error_obj = expected_values[index] - output_neuron.output
+                error_obj = expected_values[index] - output
                 # the total error, (T_j) * (O_j) * df(x)/dA_j(I)
-                error = output_neuron.deriv(output_neuron.output) * error_obj
+                error = output_layer.deriv(output) * error_obj
                 # Save data for later used
                 track_err[index] = error
                 # For each neuron in the hidden layer
-                for jindex in range(len(prev_layer)):
-                    track_weight[jindex][index] = self.weights[-1][jindex][index]
-                    prev_neuron = prev_layer[jindex]
+                for jindex in range(len(prev_outputs)):
+                    track_weight[jindex][index] = last_weights[jindex][index]
                     # w_ab = w_ab + a * dA(I)/dw_ab * dO_b/dA(I) * dErr_b/dO_b
-                    self.weights[-1][jindex][index] = self.weights[-1][jindex][index] + alpha * error * prev_neuron.output
+                    last_weights[jindex][index] = last_weights[jindex][index] + alpha * error * prev_outputs[jindex]
             # Continue for the rest of the hidden layers
             # MAGIC...
             rest_index = len(self.layers) - 2
             while rest_index > 0:
                 this_layer = self.layers[rest_index]
-                prev_layer = self.layers[rest_index - 1]
-                next_layer = self.layers[rest_index + 1]
+                this_outputs = outputs[rest_index]
+                prev_size = len(self.layers[rest_index - 1])
+                next_size = len(self.layers[rest_index + 1])
+                weights = self.weights[rest_index]
                 new_track_err = [0 for _ in range(len(this_layer))]
-                new_track_weight = [[0 for _ in range(len(this_layer))] for _ in range(len(prev_layer))]
-                for index in range(len(this_layer)):
-                    this_neuron = this_layer[index]
-                    for jindex in range(len(prev_layer)):
-                        error = 0
-                        for kindex in range(len(next_layer)):
-                            error = error + track_err[kindex] * track_weight[index][kindex]
-                        new_track_err[index] = error
-                        prev_neuron = prev_layer[jindex]
-                        new_track_weight[jindex][index] = self.weights[rest_index][jindex][index]
-                        self.weights[rest_index][jindex][index] = self.weights[rest_index][jindex][index] + alpha * error * this_neuron.deriv(this_neuron.output) * this_neuron.output
+                new_track_weight = [[0 for _ in range(len(this_layer))] for _ in range(prev_size)]
+                for index, output in enumerate(this_outputs):
+                    error = 0
+                    for kindex in range(next_size):
+                        error = error + track_err[kindex] * track_weight[index][kindex]
+                    new_track_err[index] = error
+                    step = alpha * error * this_layer.deriv(output) * output
+                    for jindex in range(prev_size):
+                        new_track_weight[jindex][index] = weights[jindex][index]
+                        weights[jindex][index] = weights[jindex][index] + step
                 track_err = new_track_err
                 track_weight = new_track_weight
                 rest_index = rest_index - 1
             # Last step input->first layer
-            for index in range(len(self.inputs)):
-                for jindex in range(len(self.layers[0])):
-                    neuron = self.layers[0][jindex]
-                    error = 0
-                    for kindex in range(len(self.layers[1])):
-                        error = error + track_err[kindex] * track_weight[jindex][kindex]
-                    self.weights[0][index][jindex] = self.weights[0][index][jindex] + alpha * error * neuron.deriv(neuron.output) * self.inputs[index].value
+            first_layer = self.layers[0]
+            first_weights = self.weights[0]
+            steps = []
+            for jindex, output in enumerate(outputs[0]):
+                error = 0
+                for kindex in range(len(self.layers[1])):
+                    error = error + track_err[kindex] * track_weight[jindex][kindex]
+                steps.append(alpha * error * first_layer.deriv(output))
+            for index, value in enumerate(self.inputs.value.tolist()):
+                row = first_weights[index]
+                for jindex, step in enumerate(steps):
+                    row[jindex] = row[jindex] + step * value
         # Inputs directly connected to the outputs
         else:
             self._back_propagation_no_hidden(alpha, expected_values)
@@ -212,64 +875,178 @@ class NeuralNet():
     @classmethod
     def get_loss(cls, method="se"):
         if method == "se":
-            return lambda actual, expected: (actual - expected) ** 2
+            return squared_error
 
     @classmethod
     def get_activation(cls, name):
-        if name == "relu":
-            return lambda x: x if x > 0 else 0
-        elif name == "log":
-            return lambda x: 1/(1 + math.e ** (-x))
-        elif name == "hyper":
-            return lambda x: math.tanh(x)
+        return cls._get_registered(name).function
 
     @classmethod
     def get_deriv(cls, name):
-        if name == "relu":
-            return lambda x: 1 if x > 0 else 0
-        elif name == "log":
-            return lambda x: x * (1 - x)
-        elif name == "hyper":
-            return lambda x: 1 - x **2
-    
+        return cls._get_registered(name).deriv
+
+    @classmethod
+    def get_vector_activation(cls, name):
+        """
+        Same as `get_activation` but the returned function works on
+        a whole numpy array at once.
+        """
+        return cls._get_registered(name).vector_function
+
+    @classmethod
+    def get_vector_backward(cls, name):
+        """
+        Return a function `backward(error, output, input_)` sending the error
+        of a layer's output back through its activation function, i.e. the
+        delta used by back propagation, for whole numpy arrays.
+        """
+        return cls._get_registered(name).backward
+
     @classmethod
     def get_activation_bounds(cls, name):
-        if name == "relu":
-            return (0, 0)
-        elif name == "log":
-            return (0, 1)
-        elif name == "hyper":
-            return (-1, 1)
+        return cls._get_registered(name).bounds
+
+    @classmethod
+    def _get_registered(cls, name):
+        if name not in ACTIVATIONS:
+            raise ValueError(f"Unknown activation: {name}")
+        return ACTIVATIONS[name]
 
     @classmethod
     def create_layer(cls, n, activation):
-        result = []
-        for _ in range(n):
-            result.append(
-                Neuron(
-                    0,
-                    0,
-                    cls.get_activation(activation),
-                    cls.get_deriv(activation),
-                    cls.get_activation_bounds(activation),
-                )
-            )
-        return result
+        return Layer(
+            n,
+            cls.get_activation(activation),
+            cls.get_deriv(activation),
+            cls.get_activation_bounds(activation),
+            activation,
+        )
+
+    @classmethod
+    def iterate_batches(cls, X, y, batch_size, shuffle=False, rng=None):
+        """
+        Split `X` and `y` into mini-batches of `batch_size` samples, the
+        last batch can be smaller. Shuffle them with `rng` if `shuffle` is set.
+        """
+        if shuffle:
+            order = (rng or np.random.default_rng()).permutation(len(X))
+        for start in range(0, len(X), batch_size):
+            if shuffle:
+                index = order[start:start + batch_size]
+                yield X[index], y[index]
+            else:
+                yield X[start:start + batch_size], y[start:start + batch_size]
 
     @classmethod
     def create_input(cls, n):
-        result = []
-        for _ in range(n):
-            result.append(Input(0))
-        return result
+        return InputLayer(n)
 
     def _back_propagation_no_hidden(self, alpha, expected_values):
-        for index in range(len(self.outputs)):
-            output_neuron = self.outputs[index]
-            for jindex in range(len(self.inputs)):
-                error_obj = expected_values[index] - output_neuron.output
-                deriv = output_neuron.deriv(output_neuron.output)
-                self.weights[0][jindex][index] = self.weights[0][jindex][index] + alpha * self.inputs[jindex].value * deriv * error_obj
+        output_layer = self.layers[0]
+        inputs = self.inputs.value.tolist()
+        weights = self.weights[0]
+        for index, output in enumerate(output_layer.output.tolist()):
+            error_obj = expected_values[index] - output
+            deriv = output_layer.deriv(output)
+            for jindex, value in enumerate(inputs):
+                weights[jindex][index] = weights[jindex][index] + alpha * value * deriv * error_obj
+
+    def _end_epoch(self, i, average_loss, samples, checkpoint, checkpoint_every, profiler):
+        self.epochs_trained = self.epochs_trained + 1
+        print("After", i+1, "epoch, average loss:", average_loss)
+        if checkpoint and self.epochs_trained % checkpoint_every == 0:
+            self.save(checkpoint)
+        if profiler:
+            profiler.end_epoch(self.epochs_trained, average_loss, samples)
+
+    def _link_numpy(self, init_weight, rand_weight_range):
+        # One (previous layer size x layer size) matrix per layer, so
+        # self.weights[l][j][i] still means the same as in the python backend
+        sizes = [len(self.inputs)] + [len(layer) for layer in self.layers]
+        self.weights = []
+        for i in range(len(self.layers)):
+            shape = (sizes[i], sizes[i+1])
+            if rand_weight_range is not None:
+                layer_weights = np.random.uniform(rand_weight_range[0], rand_weight_range[1], shape)
+            else:
+                layer_weights = np.full(shape, init_weight, dtype=np.float64)
+            self.weights.append(layer_weights)
+        self.weight_size = sum(w.size for w in self.weights)
+        return self.weights
+
+    def _feed_forward_numpy(self, input_values):
+        self.inputs.value[:] = input_values
+        output = self.inputs.value
+        for i in range(len(self.layers)):
+            layer = self.layers[i]
+            np.matmul(output, self.weights[i], out=layer.input_)
+            layer.output[:] = self._vector_activations[i](layer.input_)
+            output = layer.output
+        return self.outputs
+
+    def _back_propagation_numpy(self, expected_values, alpha):
+        # delta of a layer is df/dA * error, where the error of the output
+        # layer is (T_j - O_j) and the error of a hidden layer is the delta
+        # of the next layer sent back through the (not yet updated) weights
+        layer = self.layers[-1]
+        expected = np.asarray(expected_values, dtype=np.float64)
+        delta = self._vector_backwards[-1](expected - layer.output, layer.output, layer.input_)
+        for i in range(len(self.weights) - 1, -1, -1):
+            prev_output = self.layers[i-1].output if i > 0 else self.inputs.value
+            if i > 0:
+                prev_layer = self.layers[i-1]
+                prev_delta = self._vector_backwards[i-1](self.weights[i] @ delta, prev_output, prev_layer.input_)
+            self.weights[i] += alpha * np.outer(prev_output, delta)
+            if i > 0:
+                delta = prev_delta
+
+    def _batch_gradients(self, X, y, profiler=None):
+        return batch_gradients(self.weights, self._vector_activations, self._vector_backwards, self.loss, X, y, profiler)
+
+    def _train_parallel(self, X_train, y_train, epoch, alpha, batch_size, shuffle, rng, workers,
+                        checkpoint, checkpoint_every, profiler):
+        if self.backend != "numpy":
+            raise ValueError("Parallel training requires the numpy backend")
+        X_train = np.asarray(X_train)
+        y_train = np.asarray(y_train)
+        arrays = [X_train, y_train] + self.weights
+        shm, specs = _share_arrays(arrays)
+        shared = _attach_arrays(shm, specs)
+        X_shared, y_shared, weights = shared[0], shared[1], shared[2:]
+        names = [layer.name for layer in self.layers]
+        original_weights = self.weights
+        self.weights = weights
+        timer = profiler.time if profiler else _no_timer
+        try:
+            with multiprocessing.Pool(workers, _init_worker, (shm.name, specs, names, self.loss)) as pool, \
+                    (profiler.running() if profiler else contextlib.nullcontext()):
+                positions = np.arange(len(X_shared))
+                for i in range(epoch):
+                    score = 0
+                    for index, _ in self.iterate_batches(positions, positions, batch_size, shuffle, rng):
+                        # Shards are reduced in order so the result does not depend on timing
+                        with timer("workers"):
+                            results = pool.map(_worker_gradients, np.array_split(index, workers))
+                        norms = []
+                        with timer("update"):
+                            for j in range(len(weights)):
+                                gradient = results[0][0][j]
+                                for gradients, _ in results[1:]:
+                                    gradient = gradient + gradients[j]
+                                weights[j] += alpha / len(index) * gradient
+                                if profiler:
+                                    norms.append(alpha / len(index) * np.linalg.norm(gradient))
+                        if profiler:
+                            profiler.count_updates(norms=norms)
+                        score = score + sum(batch_score for _, batch_score in results)
+                    self._end_epoch(i, score / len(X_shared), len(X_shared), checkpoint, checkpoint_every, profiler)
+            for j in range(len(weights)):
+                original_weights[j][:] = weights[j]
+        finally:
+            self.weights = original_weights
+            del X_shared, y_shared, weights, shared
+            shm.close()
+            shm.unlink()
 
     def _initialize_weight(self, init_weight, rand_weight_range):
         if rand_weight_range is not None:
@@ -284,48 +1061,33 @@ class NeuralNet():
         return self.__str__()
 
 
-(X_train, y_train), (X_test, y_test) = mnist.load_data()
-nn = NeuralNet(
-    NeuralNet.create_input(28*28),
-    [
-        NeuralNet.create_layer(10, "hyper")
-    ],
-    NeuralNet.get_loss()
-)
-nn.link()
-# Some updates required because of the implementation of the network
-modified_y_train = []
-for y in y_train:
-    modified_y_train.append(
-        [1 if a == y else 0 for a in range(10)]
-    )
-modified_y_test = []
-for y in y_test:
-    modified_y_test.append(
-        [1 if a == y else 0 for a in range(10)]
+if __name__ == "__main__":
+    from mnist_data import load_mnist
+
+    # Flattened, normalized images and one-hot labels, cached on disk
+    (X_train, y_train, Y_train), (X_test, y_test, Y_test) = load_mnist()
+    nn = NeuralNet(
+        NeuralNet.create_input(28*28),
+        [
+            NeuralNet.create_layer(10, "hyper")
+        ],
+        NeuralNet.get_loss(),
+        backend="numpy",
     )
-modified_X_train = []
-for x in X_train:
-    modified_X_train.append(x.flatten() / 255)
-modified_X_test = []
-for x in X_test:
-    modified_X_test.append(x.flatten() / 255)
-
-# Unfortunately the network training is very slow without any optimization,
-# therefore, we can only train a very small portion of them. The original
-# train size is 60000 and each image has size 28*28=784, it will take forever
-# to train. Please modify the train_size accorindingly
-train_size = 100
-epochs = 20
-learning_rate = 0.01
-print("\nStart training with train_size=" + str(train_size))
-nn.train(modified_X_train[:train_size], modified_y_train[:train_size], epochs, learning_rate)
-
-test_size = 100
-correct = 0
-for i in range(test_size):
-    expected = y_test[i]
-    index, value = nn.predict(modified_X_test[i])
-    if index == expected:
-        correct = correct + 1
-print("\nWith test_size=" + str(test_size), ", the correct rate is:", correct / test_size)
+    nn.link()
+
+    # Unfortunately the network training is very slow without any optimization,
+    # therefore, we can only train a very small portion of them. The original
+    # train size is 60000 and each image has size 28*28=784, it will take forever
+    # to train with the "python" backend. The "numpy" backend can go through the
+    # whole set in a few seconds per epoch. Please modify the train_size accorindingly
+    train_size = 60000
+    epochs = 20
+    learning_rate = 0.01
+    print("\nStart training with train_size=" + str(train_size))
+    nn.train(X_train[:train_size], Y_train[:train_size], epochs, learning_rate)
+
+    test_size = len(X_test)
+    indices, scores = nn.predict_batch(X_test[:test_size])
+    correct = int(np.sum(indices == y_test[:test_size]))
+    print("\nWith test_size=" + str(test_size), ", the correct rate is:", correct / test_size)
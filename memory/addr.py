@@ -19,6 +19,7 @@ Calculate single paging:
       Page Number       Offset
          4 bits         12 bits
 """
+import heapq
 from math import log2
 
 def addr_translate(vaddr, page_table, page_size=4096, hexstr=False):
@@ -37,15 +38,72 @@ def addr_translate(vaddr, page_table, page_size=4096, hexstr=False):
     `hexstr=False`: Set it to True and the return paddr will
     be a hex string instead of integer
     """
-    page = vaddr >> 12
+    offset_size = _offset_size(page_size)
+    page = vaddr >> offset_size
     if page not in page_table:
-        raise "Page not found in page table"
+        raise ValueError("Page not found in page table")
     frame = page_table[page]
-    offset = vaddr % page_size
-    paddr = frame * page_size + offset
+    offset = vaddr & (page_size - 1)
+    paddr = (frame << offset_size) | offset
     return (paddr if not hexstr else hex(paddr), page, offset)
 
 
+def addr_translate_bulk(vaddrs, page_table, page_size=4096):
+    """
+    Address translation of many addresses at once with numpy.
+    Return the result in format `(paddr, page, offset, fault)`,
+    arrays with one entry per address. `fault` is True for the
+    addresses whose page is not in the page table, their paddr
+    is -1.
+
+    `vaddrs`: An array (or list) of virtual addresses
+
+    `page_table`: The page table in one of the formats:
+        1. A dense array of frame numbers indexed by page number,
+        -1 for the pages that are not mapped
+        2. A tuple `(pages, frames)` of arrays, the pages sorted
+        3. A dict with format {page#: frame#}
+
+    `page_size=4096`: The page size, a power of two, default is 4K
+    """
+    import numpy as np
+
+    offset_size = _offset_size(page_size)
+    vaddrs = np.asarray(vaddrs, dtype=np.int64)
+    page = vaddrs >> offset_size
+    offset = vaddrs & (page_size - 1)
+    if isinstance(page_table, dict):
+        pages = np.array(sorted(page_table), dtype=np.int64)
+        page_table = (pages, np.array([page_table[p] for p in pages.tolist()], dtype=np.int64))
+    if isinstance(page_table, tuple):
+        # Binary search of every page in the sorted pages
+        pages, frames = (np.asarray(a, dtype=np.int64) for a in page_table)
+        if len(pages) == 0:
+            found = np.zeros(len(page), dtype=bool)
+            frame = np.full(len(page), -1, dtype=np.int64)
+        else:
+            index = np.minimum(np.searchsorted(pages, page), len(pages) - 1)
+            found = pages[index] == page
+            frame = frames[index]
+    else:
+        frames = np.asarray(page_table, dtype=np.int64)
+        inside = (page >= 0) & (page < len(frames))
+        frame = frames[np.where(inside, page, 0)] if len(frames) else np.full(len(page), -1, dtype=np.int64)
+        found = inside & (frame >= 0)
+    fault = ~found
+    paddr = np.where(fault, -1, (frame << offset_size) | offset)
+    return (paddr, page, offset, fault)
+
+
+def _offset_size(page_size):
+    """
+    Number of offset bits of the page size, it must be a power of two.
+    """
+    if page_size <= 0 or page_size & (page_size - 1):
+        raise ValueError("The page size must be a power of two")
+    return page_size.bit_length() - 1
+
+
 def page_alloc(address_size, page_size=4096):
     """
     Calculate the page number size and offset size given
@@ -68,60 +126,138 @@ def page_alloc(address_size, page_size=4096):
     return (page_number_size, offset_size)
 
 
-def belady_replacement(addr_list, page):
+class BeladyResult:
     """
-    Using belady replacement to reduce the fault rate, print
-    every step on the console. Return the result in format:
-    `(evicted rate, fault rate)`
+    Result of `belady_simulate`.
+
+    `references`: Number of addresses
+
+    `faults`: Number of page faults, the addresses that were not
+    in a slot
+
+    `evictions`: Number of faults that evicted a page
+
+    `slots`: The pages in the slots at the end
+    """
+    def __init__(self, references, faults, evictions, slots):
+        self.references = references
+        self.faults = faults
+        self.evictions = evictions
+        self.slots = slots
+
+    @property
+    def hits(self):
+        return self.references - self.faults
+
+    @property
+    def fault_rate(self):
+        return self.faults / self.references if self.references else 0.0
+
+    @property
+    def evicted_rate(self):
+        return self.evictions / self.references if self.references else 0.0
+
+    def __str__(self):
+        return f"BeladyResult(references={self.references}, faults={self.faults}, evictions={self.evictions})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def belady_simulate(addr_list, page, log=None):
+    """
+    Belady (optimal) replacement: on a fault with no free slot,
+    evict the page whose next use is the furthest away, or one
+    that is never used again. Return a `BeladyResult`.
+
+    The next use of every address is found in one backward pass
+    and the slots are kept in a heap ordered by next use, so it
+    takes O(n log n) time instead of scanning the rest of the
+    addresses for every slot on every fault.
 
     `addr_list`: A list of addresses, usually use integers to
     represent the addresses.
 
     `page`: The number of pages available
+
+    `log`: A function like `print` called with the description
+    of every step, nothing is logged by default
     """
+    addr_list = list(addr_list)
+    n = len(addr_list)
+    # key[i] is minus the next index of addr_list[i] after i, or
+    # -(n + i) if it is never used again. The smallest key is the
+    # furthest next use, every key is different and tells the
+    # page: addr_list[-key % n]
+    key = [0] * n
+    seen = {}
+    for i in range(n - 1, -1, -1):
+        enter = addr_list[i]
+        key[i] = seen.get(enter, -n - i)
+        seen[enter] = -i
+
+    # Page in a slot: its key. The heap holds the keys, the ones
+    # that no longer match `resident` are outdated and skipped
+    # when they come up
+    resident = {}
+    heap = []
     slots = []
-    index = 0
-    evicted_count = 0
-    fault_count = 0
-    while index < len(addr_list):
-        enter = addr_list[index]
-        print('Slots:', slots, 'Entering', enter, end=' ')
-        if enter in slots:
-            index += 1
-            print('Existed')
-            continue
-        # Require to evict a page to make room
-        if len(slots) >= page:
-            candidate = None
-            for j in slots:
-                cpIndex = index
-                dist = -1
-                # Move forward to find the next entry of this page
-                while cpIndex < len(addr_list):
-                    # If found, record the distance
-                    if j == addr_list[cpIndex]:
-                        dist = cpIndex - index
+    faults = 0
+    evictions = 0
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    # Drop the outdated keys once they are the majority, so the
+    # heap stays about the size of the slots
+    limit = 2 * page + 64
+    for enter, k in zip(addr_list, key):
+        if log:
+            log('Slots:', slots, 'Entering', enter, end=' ')
+        if enter not in resident:
+            faults += 1
+            if len(resident) >= page:
+                while True:
+                    top = heappop(heap)
+                    victim = addr_list[-top % n]
+                    if resident.get(victim) == top:
                         break
-                    cpIndex += 1
-                if dist == -1:
-                    candidate = (dist, j)
-                else:
-                    if not candidate or candidate[0] < dist:
-                        candidate = (dist, j)
-            evicted = slots.index(candidate[1])
-            slots[evicted] = enter
-            evicted_count += 1
-            fault_count += 1
-            print('Evicted', candidate[1], 'Result', slots)
-        # Enough room to add it to the slot
-        else:
-            slots.append(enter)
-            fault_count += 1
-            print('Enough', 'Result', slots)
-        index += 1
-    return (evicted_count/len(addr_list), fault_count/len(addr_list))
+                del resident[victim]
+                evictions += 1
+                if log:
+                    slots[slots.index(victim)] = enter
+                    log('Evicted', victim, 'Result', slots)
+            elif log:
+                slots.append(enter)
+                log('Enough', 'Result', slots)
+        elif log:
+            log('Existed')
+        resident[enter] = k
+        heappush(heap, k)
+        if len(heap) > limit:
+            heap = list(resident.values())
+            heapq.heapify(heap)
+    return BeladyResult(n, faults, evictions, list(resident))
+
+
+def belady_replacement(addr_list, page, verbose=False):
+    """
+    Using belady replacement to reduce the fault rate, see
+    `belady_simulate`. Return the result in format:
+    `(evicted rate, fault rate)`
+
+    `addr_list`: A list of addresses, usually use integers to
+    represent the addresses.
+
+    `page`: The number of pages available
+
+    `verbose`: Print every step on the console
+    """
+    result = belady_simulate(addr_list, page, log=print if verbose else None)
+    return (result.evicted_rate, result.fault_rate)
 
 
-print(addr_translate(0x3468, {3: 7}, hexstr=True))
-print(page_alloc(32))
-print(belady_replacement([2,3,2,1,5,4,5,3,5,3,2], 3))
\ No newline at end of file
+if __name__ == "__main__":
+    print(addr_translate(0x3468, {3: 7}, hexstr=True))
+    # Page 3 is mapped to frame 7, page 0 is not mapped
+    print(addr_translate_bulk([0x3468, 0x3fff, 0x0010], [-1, 5, 9, 7]))
+    print(page_alloc(32))
+    print(belady_replacement([2,3,2,1,5,4,5,3,5,3,2], 3, verbose=True))
\ No newline at end of file